@@ -0,0 +1,63 @@
+"""
+تشكيل النص العربي للعرض في Kivy (arabic_reshaper ثم خوارزمية bidi) مع ذاكرة مؤقتة.
+
+رسائل الحالة تتكرر بنفس القالب وتختلف في الأرقام فقط ("جاري التحميل: 45%").
+لذلك تُستبدل كل سلسلة أرقام بخانة واحدة مؤقتة، ويُشكّل القالب مرة واحدة فقط،
+ثم تُعاد الأرقام الأصلية مكان الخانات في الناتج. هذا صحيح لأن سلسلة الأرقام
+(مع الفواصل المفردة بينها) تعامل في bidi كوحدة واحدة بنفس النوع مهما كان طولها،
+والتشكيل لا يغير الأرقام.
+"""
+import re
+from functools import lru_cache
+
+try:
+    import arabic_reshaper
+    ARABIC_RESHAPER_AVAILABLE = True
+except ImportError:
+    ARABIC_RESHAPER_AVAILABLE = False
+
+try:
+    from bidi.algorithm import get_display
+    BIDI_LIBS_AVAILABLE = True
+except ImportError:
+    BIDI_LIBS_AVAILABLE = False
+
+SHAPED_TEXT_CACHE = 4096
+SHAPED_TEMPLATE_CACHE = 1024
+_NUMBER = re.compile(r'[0-9]+(?:[.,:/][0-9]+)*')
+_PLACEHOLDER = re.compile(r'[0-9]')
+_MAX_NUMBERS = 10  # خانة لكل رقم من 0 إلى 9
+
+
+def shape(text):
+    """إصلاح السطر بالكامل ليدعم العربية المختلطة مع الإنجليزية (بدون ذاكرة مؤقتة)"""
+    processed_text = text
+    if ARABIC_RESHAPER_AVAILABLE:
+        try:
+            # تشكيل الحروف
+            processed_text = arabic_reshaper.reshape(text)
+        except Exception: pass
+    if BIDI_LIBS_AVAILABLE:
+        try:
+            # ضبط الاتجاه (Bidi Algorithm) للسطر كاملاً
+            processed_text = get_display(processed_text)
+        except Exception: pass
+    return processed_text
+
+
+_shape_text = lru_cache(maxsize=SHAPED_TEXT_CACHE)(shape)
+_shape_template = lru_cache(maxsize=SHAPED_TEMPLATE_CACHE)(shape)
+
+
+def fix_text(text):
+    if not text: return ""
+    text = str(text)
+    numbers = _NUMBER.findall(text)
+    if not numbers or len(numbers) > _MAX_NUMBERS: return _shape_text(text)
+    slots = iter('0123456789')
+    shaped = _shape_template(_NUMBER.sub(lambda m: next(slots), text))
+    return _PLACEHOLDER.sub(lambda m: numbers[int(m.group())], shaped)
+
+
+def cache_info():
+    return {'text': _shape_text.cache_info(), 'template': _shape_template.cache_info()}
@@ -0,0 +1,272 @@
+"""
+واجهة غير متزامنة (asyncio) لسلسلة توليد الكشوفات:
+access_account_statement_page -> get_report_id -> get_control_id_and_download_pdf
+
+تعمل مئات السلاسل على حلقة أحداث واحدة بدلاً من خيط لكل عميل.
+تعتمد على httpx (اختياري) وتستخدم HTTP/2 إذا كانت مكتبة h2 مثبتة.
+
+نفس ضمانات المسار المتزامن: التنزيل إلى .part مع استئناف Range والتحقق ثم
+نقل ذري (part_request_headers / finalize_part من backend)، الحركات من
+GetAccountStatement، وتخطي الكشوفات غير المتغيرة عبر StatementManifest.
+لا يدعم سجل الاستئناف (JobJournal) ولا التقسيم إلى فترات.
+"""
+import os
+import asyncio
+from threading import Thread
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+from html_extract import find_input_value
+from backend import (
+    BASE_URL, BASE_HEADERS, LOGIN_PAGE, LOGIN_POST, FINANCIAL_STATUS_PAGE, ACCOUNT_STATEMENT_PAGE,
+    GET_ACCOUNT_STATEMENT_API, REPORT_GEN_POST, REPORT_VIEWER_BASE, PDF_AXD_ENDPOINT, ENDPOINTS,
+    DEFAULT_CONCURRENCY, DOWNLOAD_RESUME_ATTEMPTS, StatementManifest, create_session_with_retry, extract_transactions_from_page, extract_report_token,
+    extract_report_id, extract_control_id, report_payload, pdf_export_params, account_statement_params,
+    parse_balance, get_client_name_from_dict, perform_full_login, get_report_token,
+    access_account_statement_page, get_report_id, get_control_id_and_download_pdf,
+    get_customer_balance, download_single_pdf, run_batch, statement_filename, extract_transactions_from_statement,
+    transactions_fingerprint, part_request_headers, finalize_part, _read_part_meta, _write_part_meta, _discard_part,
+)
+
+# حد الاتصالات المفتوحة مع الخادم (كل العملاء على نفس المضيف)
+MAX_HOST_CONNECTIONS = 20
+MAX_PIPELINES = 200
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class AsyncStatementClient:
+    """
+    نفس دوال الواجهة الخلفية بدون معامل session، كلها coroutines.
+    الترويسات لكل طلب من backend.ENDPOINTS فلا توجد حالة مشتركة بين السلاسل المتزامنة.
+    """
+
+    def __init__(self, cookies=None, max_connections=MAX_HOST_CONNECTIONS, http2=True):
+        if not HTTPX_AVAILABLE: raise RuntimeError("httpx is required for the async backend")
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(
+            base_url=BASE_URL, headers=BASE_HEADERS, cookies=cookies, limits=limits,
+            http2=http2 and HTTP2_AVAILABLE, timeout=30, follow_redirects=True
+        )
+
+    @classmethod
+    def from_session(cls, session, **kwargs):
+        """بناء عميل غير متزامن يعيد استخدام كوكيز جلسة requests قائمة"""
+        return cls(cookies=session.cookies.get_dict(), **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def perform_full_login(self, username, password):
+        get_response = await self.client.get(LOGIN_PAGE, headers=ENDPOINTS['login_page'].headers)
+        if get_response.status_code != 200: return False
+        token = find_input_value(get_response.text, '__RequestVerificationToken')
+        if token is None: return False
+        payload = {'__RequestVerificationToken': token, 'UserName': username, 'Password': password, 'RememberMe': 'true'}
+        post_response = await self.client.post(LOGIN_POST, data=payload, headers=ENDPOINTS['login'].headers, follow_redirects=False)
+        if post_response.status_code == 200:
+            try: return post_response.json().get('success') is True
+            except ValueError: return False
+        return post_response.status_code == 302
+
+    async def get_report_token(self):
+        try: return extract_report_token((await self.client.get(FINANCIAL_STATUS_PAGE, headers=ENDPOINTS['token_page'].headers)).text)
+        except httpx.HTTPError: return ""
+
+    async def get_account_statement(self, agency_id, from_date='01/01/2025', to_date=''):
+        try:
+            response = await self.client.get(GET_ACCOUNT_STATEMENT_API, params=account_statement_params(agency_id, from_date, to_date),
+                                             headers=ENDPOINTS['account_statement'].headers, timeout=ENDPOINTS['account_statement'].timeout)
+            if response.status_code == 200: return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Balance Fetch Error for {agency_id}: {e}")
+        return None
+
+    async def get_customer_balance(self, agency_id, from_date='01/01/2025'):
+        data = await self.get_account_statement(agency_id, from_date)
+        return parse_balance(data) if data is not None else ("N/A", 0.0)
+
+    async def resolve_client_statement(self, client_id, from_date, to_date=''):
+        """مثل backend.resolve_client_statement: الرصيد والحركات من GetAccountStatement"""
+        data = await self.get_account_statement(client_id, from_date)
+        balance_raw, balance_float = parse_balance(data) if data is not None else ("N/A", 0.0)
+        if to_date: data = await self.get_account_statement(client_id, from_date, to_date)
+        return balance_raw, balance_float, extract_transactions_from_statement(data)
+
+    async def access_account_statement_page(self, agency_id):
+        response = await self.client.get(f"{ACCOUNT_STATEMENT_PAGE}/{agency_id}", headers=ENDPOINTS['statement_page'].headers)
+        return response.text if response.status_code == 200 else None
+
+    async def get_report_id(self, agency_id, report_token, transactions_list, from_date='01/01/2025', to_date=''):
+        payload = report_payload(agency_id, report_token, transactions_list, from_date, to_date)
+        response = await self.client.post(REPORT_GEN_POST, data=payload, headers=ENDPOINTS['report'].headers, timeout=ENDPOINTS['report'].timeout)
+        return extract_report_id(response.text) if response.status_code == 200 else None
+
+    async def get_control_id_and_download_pdf(self, report_id, client_name, client_id, final_filename, progress_callback=None, stop_event=None):
+        try:
+            report_view_response = await self.client.get(REPORT_VIEWER_BASE, params={'id': report_id}, headers=ENDPOINTS['viewer'].headers,
+                                                         timeout=ENDPOINTS['viewer'].timeout)
+            control_id = extract_control_id(report_view_response.text)
+            if not control_id: return False
+            return await self.download_to_file(final_filename, pdf_export_params(control_id, client_name), progress_callback, stop_event)
+        except httpx.HTTPError: return False
+
+    async def download_to_file(self, final_filename, params, progress_callback=None, stop_event=None, attempts=DOWNLOAD_RESUME_ATTEMPTS):
+        """نفس backend.download_to_file: ملف .part، استئناف Range/If-Range، تحقق ثم نقل ذري"""
+        os.makedirs(os.path.dirname(final_filename) or '.', exist_ok=True)
+        part = final_filename + '.part'
+        meta = _read_part_meta(part)
+        same_url = False
+        for _ in range(max(1, attempts)):
+            offset, headers = part_request_headers(part, meta, same_url)
+            try:
+                async with self.client.stream('GET', PDF_AXD_ENDPOINT, params=params, headers=dict(ENDPOINTS['pdf'].headers, **headers),
+                                              timeout=ENDPOINTS['pdf'].timeout) as response:
+                    if response.status_code == 416:
+                        _discard_part(part); meta = {}; continue
+                    if response.status_code == 206 and 'Range' in headers: mode, downloaded = 'ab', offset
+                    elif response.status_code == 200: mode, downloaded = 'wb', 0
+                    else: return False
+                    same_url = response.headers.get('accept-ranges', '').lower() == 'bytes'
+                    encoded = response.headers.get('content-encoding', 'identity').lower() != 'identity'
+                    length = int(response.headers.get('content-length', 0) or 0)
+                    total_size = downloaded + length if length and not encoded else 0
+                    if mode == 'wb':
+                        meta = {'etag': response.headers.get('etag'), 'last_modified': response.headers.get('last-modified'), 'total': total_size}
+                        _write_part_meta(part, meta)
+                    with open(part, mode) as f:
+                        async for chunk in response.aiter_bytes(PDF_CHUNK_SIZE):
+                            if stop_event and stop_event.is_set(): return False
+                            f.write(chunk); downloaded += len(chunk)
+                            if progress_callback: progress_callback(downloaded, total_size)
+                done = finalize_part(part, final_filename, downloaded, total_size or meta.get('total') or 0)
+                if done is not None: return done
+            except (httpx.HTTPError, OSError):
+                continue
+        return False
+
+    async def download_single_pdf(self, client_id, client_name, output_dir, from_date, to_date, report_token, progress_callback=None,
+                                  stop_event=None, manifest=None, transactions=None):
+        try:
+            if stop_event and stop_event.is_set(): return False, "Cancelled"
+            txs = transactions
+            if txs is None: txs = extract_transactions_from_page(await self.access_account_statement_page(client_id))
+            if txs is None: return False, "Statement failed"
+            final_filename = statement_filename(output_dir, client_name, client_id)
+            tx_hash = transactions_fingerprint(txs) if manifest is not None else None
+            if tx_hash and manifest.lookup(client_id, from_date, to_date, tx_hash, final_filename): return True, "Unchanged"
+            rid = await self.get_report_id(client_id, report_token, txs, from_date, to_date)
+            if not rid: return False, "Report failed"
+            if await self.get_control_id_and_download_pdf(rid, client_name, client_id, final_filename, progress_callback, stop_event):
+                if tx_hash: manifest.record(client_id, from_date, to_date, tx_hash, final_filename)
+                return True, " "
+            return False, "Download failed"
+        except Exception as e: return False, str(e)
+
+    async def run_batch(self, client_ids, customers, out_dir, from_date, to_date, report_token,
+                        concurrency=MAX_PIPELINES, on_start=None, on_progress=None, on_done=None, stop_event=None, skip_unchanged=True):
+        """مثل backend.run_batch: النتائج بترتيب المدخلات، وعدد السلاسل المتزامنة محدود"""
+        total = len(client_ids)
+        manifest = StatementManifest(out_dir) if skip_unchanged else None
+        gate = asyncio.Semaphore(max(1, int(concurrency or 1)))
+
+        async def handle(idx, cid):
+            async with gate:
+                if stop_event and stop_event.is_set(): return None
+                name = get_client_name_from_dict(cid, customers)
+                if on_start: on_start(idx, total, cid, name)
+                bal_raw, bal_float, txs = await self.resolve_client_statement(cid, from_date, to_date)
+                row = {'id': cid, 'name': name, 'balance': bal_raw, 'balance_float': bal_float}
+                prog = (lambda cur, tot: on_progress(idx, total, row, cur, tot)) if on_progress else None
+                row['ok'], row['msg'] = await self.download_single_pdf(cid, name, out_dir, from_date, to_date, report_token, prog,
+                                                                       stop_event, manifest, txs)
+                if row['ok']: row['file'] = statement_filename(out_dir, name, cid)
+                if on_done: on_done(idx, total, row)
+                return row
+
+        results = await asyncio.gather(*(handle(idx, cid) for idx, cid in enumerate(client_ids, 1)))
+        return [r for r in results if r is not None]
+
+
+class SyncStatementClient:
+    """
+    واجهة متزامنة فوق AsyncStatementClient لواجهة Kivy والسكربتات:
+    حلقة أحداث واحدة في خيط خلفي وكل استدعاء ينتظر نتيجته.
+    """
+
+    def __init__(self, session=None, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        cookies = session.cookies.get_dict() if session is not None else None
+        self._client = self._run(self._create(cookies, kwargs))
+
+    async def _create(self, cookies, kwargs):
+        return AsyncStatementClient(cookies=cookies, **kwargs)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError(name)
+        method = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(method): return method
+        return lambda *args, **kwargs: self._run(method(*args, **kwargs))
+
+    def close(self):
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class RequestsStatementClient:
+    """نفس الواجهة فوق دوال requests المتزامنة الحالية"""
+
+    def __init__(self, session=None):
+        self.session = session or create_session_with_retry()
+
+    def perform_full_login(self, username, password): return perform_full_login(self.session, username, password)
+    def get_report_token(self): return get_report_token(self.session)
+    def get_customer_balance(self, agency_id, from_date='01/01/2025'): return get_customer_balance(self.session, agency_id, from_date)
+    def access_account_statement_page(self, agency_id): return access_account_statement_page(self.session, agency_id)
+
+    def get_report_id(self, agency_id, report_token, transactions_list, from_date='01/01/2025', to_date=''):
+        return get_report_id(self.session, agency_id, report_token, transactions_list, from_date, to_date)
+
+    def get_control_id_and_download_pdf(self, report_id, client_name, client_id, final_filename, progress_callback=None, stop_event=None):
+        return get_control_id_and_download_pdf(self.session, report_id, client_name, client_id, final_filename, progress_callback, stop_event)
+
+    def download_single_pdf(self, client_id, client_name, output_dir, from_date, to_date, report_token, progress_callback=None, stop_event=None):
+        return download_single_pdf(self.session, client_id, client_name, output_dir, from_date, to_date, report_token, progress_callback, stop_event)
+
+    def run_batch(self, client_ids, customers, out_dir, from_date, to_date, report_token,
+                  concurrency=DEFAULT_CONCURRENCY, on_start=None, on_progress=None, on_done=None, stop_event=None):
+        return run_batch(self.session, client_ids, customers, out_dir, from_date, to_date, report_token,
+                         concurrency, on_start, on_progress, on_done, stop_event)
+
+    def close(self):
+        self.session.close()
+
+
+def make_statement_client(session=None, backend='requests', **kwargs):
+    """اختيار الواجهة الخلفية ('requests' أو 'async') بنفس الدوال"""
+    if backend == 'async':
+        if not HTTPX_AVAILABLE: raise RuntimeError("httpx is required for the async backend")
+        return SyncStatementClient(session, **kwargs)
+    if backend != 'requests': raise ValueError(f"unknown backend: {backend}")
+    return RequestsStatementClient(session)
@@ -0,0 +1,955 @@
+"""
+الواجهة الخلفية لأداة الكشوفات: تسجيل الدخول، دليل العملاء، الأرصدة، توليد
+الكشوفات وتنزيلها، والملخص. لا تستورد Kivy لذلك تعمل من سطر الأوامر
+(cli.py) أو من cron على خادم بدون شاشة. المكتبات الثقيلة (openpyxl) تُحمّل عند الحاجة فقط.
+"""
+import os
+import re
+import time
+import json
+import hashlib
+import socket
+import urllib.parse
+from threading import Thread, Lock, BoundedSemaphore, local
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
+
+from customer_store import CustomerStore, CUSTOMERS_DB_FILE, SEARCH_LIMIT
+from html_extract import find_input_value, collect_input_values, scan_chunks
+from ratelimit import AdaptiveRateLimiter, ObservedRetry
+from journal import JobJournal
+from metrics import register_stages, observe_transfer
+
+# --- Configuration ---
+# BOOKING_BASE_URL يوجه الطلبات لخادم آخر (مثل benchmarks/replay_server.py)
+BASE_URL = os.getenv('BOOKING_BASE_URL', "https://arkan-int.joodbooking.com").rstrip('/')
+LOGIN_PAGE = "/Account/Login?ReturnUrl=%2FBookingWorkflow%2FIndex"
+LOGIN_POST = "/Account/Login"
+FINANCIAL_STATUS_PAGE = "/FinancialStatus/CustomerFinancialStatus"
+ACCOUNT_STATEMENT_PAGE = "/Finance/AccountStatement"
+# تم تحديث الرابط بناءً على تحليل الملفات المرفقة
+GET_ACCOUNT_STATEMENT_API = "/Finance/GetAccountStatement" 
+REPORT_GEN_POST = "/Finance/ReportAccountStatement"
+REPORT_VIEWER_BASE = "/Reports/Viewer.aspx"
+PDF_AXD_ENDPOINT = "/Reserved.ReportViewerWebControl.axd"
+CUSTOMER_FINANCIAL_STATUS_GET = "/FinancialStatus/GetCustomerFinancialStatus"
+
+USERNAME = os.getenv('BOOKING_USERNAME', '')
+PASSWORD = os.getenv('BOOKING_PASSWORD', '')
+SESSION_FILE = "session_cookies.json"
+MANIFEST_FILENAME = ".statements_manifest.json"
+CUSTOMERS_CACHE_FILE = "customers_cache.json"  # الصيغة القديمة، تُرحّل إلى CUSTOMERS_DB_FILE
+CACHE_EXPIRY_HOURS = 24
+DATE_FORMAT = "%d/%m/%Y"  # صيغة fromDate / toDate في الموقع
+CUSTOMER_PAGE_SIZE = 500
+CUSTOMER_PAGE_WORKERS = 4
+CUSTOMER_TOTAL_KEY = "total"
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+HTML_SCAN_CHUNK_SIZE = 64 * 1024
+# شكل GetAccountStatement المعتمد فقط؛ غيره يعود لمربعات Transactions في صفحة الكشف
+STATEMENT_ROWS_KEY = 'data'
+TRANSACTION_ID_KEY = 'TransactionId'
+BALANCE_KEYS = ('TotalBalance', 'Balance', 'CurrentBalance', 'NetBalance')
+DOWNLOAD_RESUME_ATTEMPTS = 3
+DEFAULT_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+PIPELINE_QUEUE_FACTOR = 2
+PIPELINE_POLL_SECONDS = 0.5
+RELOGIN_ATTEMPTS = 2  # تسجيل الدخول التالي قد ينتهي أيضاً أثناء إعادة عميل طويل (أجزاء sharding)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+BASE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Origin': BASE_URL
+}
+
+socket.setdefaulttimeout(30)
+POOL_SIZE = MAX_CONCURRENCY * 2  # عمال التوليد والتنزيل على نفس الجلسة
+
+class Endpoint:
+    """
+    وصف ثابت لنقطة نهاية: الطريقة والمسار والترويسات الخاصة بها والمهلة.
+    الترويسات تُرسل مع الطلب نفسه (requests يدمجها مع BASE_HEADERS) ولا يُعدل
+    session.headers أبداً، فنفس الجلسة ومجمع اتصالاتها آمنان بين الخيوط.
+    """
+
+    def __init__(self, method, path, referer=None, ajax=False, content_type=None, timeout=30, allow_redirects=True):
+        self.method, self.path, self.timeout, self.allow_redirects = method, path, timeout, allow_redirects
+        self.headers = {}
+        if referer: self.headers['Referer'] = BASE_URL + referer
+        if ajax: self.headers['X-Requested-With'] = 'XMLHttpRequest'
+        if content_type: self.headers['Content-Type'] = content_type
+
+    def url(self, **path_args):
+        return BASE_URL + (self.path.format(**path_args) if path_args else self.path)
+
+FORM = 'application/x-www-form-urlencoded'
+ENDPOINTS = {
+    'login_page': Endpoint('GET', LOGIN_PAGE, referer=LOGIN_PAGE),
+    'login': Endpoint('POST', LOGIN_POST, referer=LOGIN_PAGE, ajax=True, content_type=FORM, allow_redirects=False),
+    'token_page': Endpoint('GET', FINANCIAL_STATUS_PAGE, referer=FINANCIAL_STATUS_PAGE, ajax=True),
+    'customers': Endpoint('GET', CUSTOMER_FINANCIAL_STATUS_GET, referer=FINANCIAL_STATUS_PAGE, ajax=True),
+    'account_statement': Endpoint('GET', GET_ACCOUNT_STATEMENT_API, referer=ACCOUNT_STATEMENT_PAGE, ajax=True, timeout=60),
+    'statement_page': Endpoint('GET', ACCOUNT_STATEMENT_PAGE + '/{agency_id}', referer=FINANCIAL_STATUS_PAGE),
+    'report': Endpoint('POST', REPORT_GEN_POST, referer=FINANCIAL_STATUS_PAGE, ajax=True,
+                       content_type=FORM + '; charset=UTF-8', timeout=300),
+    'viewer': Endpoint('GET', REPORT_VIEWER_BASE, referer=FINANCIAL_STATUS_PAGE, timeout=180),
+    'pdf': Endpoint('GET', PDF_AXD_ENDPOINT, referer=FINANCIAL_STATUS_PAGE, timeout=600),
+}
+
+# مراحل القياس في metrics بنفس أسماء نقاط النهاية
+register_stages({name: (ep.method, ep.path) for name, ep in ENDPOINTS.items()})
+
+def call(session, name, path_args=None, headers=None, **kwargs):
+    """طلب إلى ENDPOINTS[name]؛ headers إضافية لهذا الطلب فقط (مثل Range)"""
+    endpoint = ENDPOINTS[name]
+    kwargs.setdefault('timeout', endpoint.timeout)
+    kwargs.setdefault('allow_redirects', endpoint.allow_redirects)
+    return session.request(endpoint.method, endpoint.url(**(path_args or {})),
+                           headers=dict(endpoint.headers, **headers) if headers else endpoint.headers, **kwargs)
+
+# --- Backend Functions ---
+
+def save_session_cookies(session, filename=SESSION_FILE, owner=''):
+    # JSON بدلاً من pickle: لا ينفذ شيفرة عند القراءة ويحتفظ بالنطاق والمسار والانتهاء
+    cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure, 'expires': c.expires}
+               for c in session.cookies]
+    tmp = filename + '.tmp'
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'owner': owner, 'cookies': cookies}, f, separators=(',', ':'))
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, filename)
+    except Exception: pass
+
+def load_session_cookies(session, filename=SESSION_FILE, owner=None):
+    """owner (اسم المستخدم) يمنع استخدام كوكيز حساب آخر"""
+    if not os.path.exists(filename): return False
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if owner is not None and data.get('owner') != owner: return False
+        cookies = data.get('cookies', [])
+        now = time.time()
+        for c in cookies:
+            if c.get('expires') and c['expires'] < now: continue
+            session.cookies.set(c['name'], c['value'], domain=c.get('domain', ''), path=c.get('path', '/'),
+                                secure=c.get('secure', False), expires=c.get('expires'))
+        return bool(cookies)
+    except Exception: return False
+
+def is_login_redirect(response):
+    """الخادم يحوّل إلى صفحة الدخول (أو يعيد 401) عند انتهاء الجلسة"""
+    if response.status_code == 401: return True
+    return response.is_redirect and '/Account/Login' in response.headers.get('Location', '')
+
+def perform_full_login(session, username, password):
+    get_response = call(session, 'login_page')
+    if get_response.status_code != 200: return False
+    dynamic_token = find_input_value(get_response.text, '__RequestVerificationToken')
+    if dynamic_token is None: return False
+    payload = {'__RequestVerificationToken': dynamic_token, 'UserName': username, 'Password': password, 'RememberMe': 'true'}
+    post_response = call(session, 'login', data=payload)
+    if post_response.status_code == 200:
+        try: return post_response.json().get('success') is True
+        except: return False
+    elif post_response.status_code == 302: return True
+    return False
+
+def _customer_total_count(data):
+    # حقل العدد في DataSourceResult فقط؛ مفتاح عام مثل Total قد يكون مجموع أرصدة
+    try: return int(data[CUSTOMER_TOTAL_KEY])
+    except (KeyError, TypeError, ValueError): return None
+
+def fetch_customer_status_page(session, page, page_size=CUSTOMER_PAGE_SIZE):
+    """صفحة واحدة من GetCustomerFinancialStatus: (الصفوف، العدد الكلي إن وُجد)"""
+    search_params = {'AgencyType': '4', 'page': str(page), 'pageSize': str(page_size)}
+    response = call(session, 'customers', params=search_params)
+    if response.status_code != 200: return None, None
+    try:
+        data = response.json()
+        return data.get('data', []) or [], _customer_total_count(data)
+    except: return None, None
+
+def fetch_customer_status_rows(session, page_size=CUSTOMER_PAGE_SIZE):
+    """
+    كل صفوف قائمة العملاء: (الصفوف، هل اكتملت كل الصفحات).
+    بعد الصفحة الأولى إذا عُرف العدد الكلي تُجلب بقية الصفحات بالتوازي،
+    وإلا نكمل صفحة بصفحة كما في السابق.
+    "مكتملة" فقط إذا عادت كل الصفحات ممتلئة ما عدا الأخيرة: العدد الكلي مجرد
+    تلميح، والقائمة المكتملة تحذف من الدليل المحلي كل من لم يظهر فيها.
+    """
+    rows, total = fetch_customer_status_page(session, 1, page_size)
+    if rows is None: return [], False
+    if len(rows) < page_size: return rows, True
+    page = 2
+    if total:
+        pages = list(range(2, -(-total // page_size) + 1))
+        with ThreadPoolExecutor(max_workers=CUSTOMER_PAGE_WORKERS) as pool:
+            results = list(pool.map(lambda p: fetch_customer_status_page(session, p, page_size)[0], pages))
+        for page_rows in results: rows.extend(page_rows or [])
+        if any(r is None for r in results) or any(len(r) < page_size for r in results[:-1]): return rows, False
+        if results and len(results[-1]) < page_size: return rows, True
+        # العدد أقل من الحقيقة (آخر صفحة ممتلئة): نكمل صفحة بصفحة
+        page = (pages[-1] if pages else 1) + 1
+    while True:
+        page_rows, _ = fetch_customer_status_page(session, page, page_size)
+        if page_rows is None: return rows, False
+        rows.extend(page_rows)
+        if len(page_rows) < page_size: return rows, True
+        page += 1
+
+_customer_store = None
+_customer_store_lock = Lock()
+
+def open_customer_store():
+    """المخزن المحلي (SQLite) مفتوح مرة واحدة، مع ترحيل customers_cache.json القديم"""
+    global _customer_store
+    with _customer_store_lock:
+        if _customer_store is None:
+            _customer_store = CustomerStore(CUSTOMERS_DB_FILE)
+            if not _customer_store: _customer_store.import_json_cache(CUSTOMERS_CACHE_FILE)
+        return _customer_store
+
+def download_and_cache_customers(session, store=None):
+    store = store if store is not None else open_customer_store()
+    rows, complete = fetch_customer_status_rows(session)
+    all_customers = {}
+    for c in rows:
+        cid, cname = str(c.get('CustomerId', '')), c.get('CustomerName', '')
+        if cid and cname: all_customers[cid] = cname
+    # عند فشل بعض الصفحات لا نحذف العملاء الذين لم نتمكن من التحقق منهم
+    if all_customers: store.sync(all_customers, complete=complete)
+    return store
+
+def load_customers_cache(allow_stale=False):
+    store = open_customer_store()
+    if not store: return None
+    if not allow_stale and customers_cache_age_hours() > CACHE_EXPIRY_HOURS: return None
+    return store
+
+def customers_cache_age_hours():
+    return open_customer_store().age_hours()
+
+_customers_refresh_lock = Lock()
+
+def refresh_customers_in_background(session, store=None):
+    """
+    إعادة التحقق من دليل العملاء في الخلفية (stale-while-revalidate).
+    المخزن يُحدّث في مكانه فيرى المستخدمون الحاليون الأسماء الجديدة. طلب واحد فقط في كل مرة.
+    """
+    if not _customers_refresh_lock.acquire(blocking=False): return None
+
+    def _refresh():
+        try: download_and_cache_customers(session, store)
+        except Exception as e:
+            print(f"Customers Refresh Error: {e}")
+        finally:
+            _customers_refresh_lock.release()
+
+    t = Thread(target=_refresh, daemon=True)
+    t.start()
+    return t
+
+def extract_report_token(html_content):
+    # الحقل المسمى أولاً؛ وإلا أول value كما في الأصل (استجابة ajax الجزئية)
+    token = find_input_value(html_content or '', '__RequestVerificationToken')
+    if token: return token
+    match = re.search(r'value="([^"]+)"', html_content or '')
+    return match.group(1) if match else ""
+
+def get_report_token(session):
+    try: return extract_report_token(call(session, 'token_page').text)
+    except: return ""
+
+def get_all_client_names(session):
+    """
+    الدليل المخزن يُعاد فوراً حتى لو انتهت صلاحيته، ويُحدّث في الخلفية.
+    التنزيل الكامل المتزامن فقط عند عدم وجود أي نسخة محلية.
+    """
+    cached = load_customers_cache(allow_stale=True)
+    if not cached: return download_and_cache_customers(session)
+    if customers_cache_age_hours() > CACHE_EXPIRY_HOURS: refresh_customers_in_background(session, cached)
+    return cached
+
+def search_clients(query, limit=SEARCH_LIMIT):
+    """اقتراحات العملاء [(id, name)] بالرقم أو ببادئة الاسم أو بحث تقريبي"""
+    try: return open_customer_store().search(query, limit)
+    except Exception: return []
+
+def get_client_name_from_dict(client_id, customers_dict):
+    name = customers_dict.get(str(client_id))
+    return name if name else f"Client_{client_id}"
+
+def access_account_statement_page(session, agency_id):
+    response = call(session, 'statement_page', {'agency_id': agency_id})
+    return response.text if response.status_code == 200 else None
+
+def extract_transactions_from_page(html_content):
+    if html_content is None: return None
+    try: return ','.join(collect_input_values(html_content, 'Transactions', 'checkbox'))
+    except: return None
+
+def fetch_statement_transactions(session, agency_id):
+    """
+    مثل access_account_statement_page ثم extract_transactions_from_page لكن
+    الصفحة تُمسح أثناء التنزيل بدون الاحتفاظ بها كاملة في الذاكرة.
+    يعيد None إذا تعذر جلب الصفحة.
+    """
+    try:
+        with call(session, 'statement_page', {'agency_id': agency_id}, stream=True) as response:
+            if response.status_code != 200: return None
+            response.encoding = response.encoding or 'utf-8'
+            ids = scan_chunks(response.iter_content(HTML_SCAN_CHUNK_SIZE, decode_unicode=True), 'Transactions', 'checkbox')
+        return ','.join(ids)
+    except: return None
+
+def extract_transactions_from_statement(data):
+    """
+    أرقام الحركات من JSON كشف الحساب (نفس قيم مربعات Transactions في الصفحة).
+    None إذا لم نتعرف على شكل البيانات (المتصل يعود للصفحة)، و '' إذا لم توجد حركات.
+    """
+    rows = data.get(STATEMENT_ROWS_KEY) if isinstance(data, dict) else None
+    if not isinstance(rows, list): return None
+    ids = []
+    for row in rows:
+        tx_id = row.get(TRANSACTION_ID_KEY) if isinstance(row, dict) else None
+        if tx_id in (None, ''): return None
+        ids.append(str(tx_id))
+    return ','.join(ids)
+
+def report_payload(agency_id, report_token, transactions_list, from_date='01/01/2025', to_date=''):
+    return {
+        '__RequestVerificationToken': report_token, 
+        'Transactions': transactions_list, 
+        'fromDate': from_date, 
+        'toDate': to_date, 
+        'AgencyId': agency_id, 
+        'CurrencyId': 'SAR', 
+        'BookingStatus': '3', 
+        'RoomStatus': '2'
+    }
+
+def extract_report_id(text):
+    match = re.search(r'id=([0-9a-f\-]{36})', text or '', re.IGNORECASE)
+    return match.group(1) if match else None
+
+def extract_control_id(text):
+    match = re.search(r'ControlID=([0-9a-fA-F]{32})', text or '')
+    return match.group(1) if match else None
+
+def pdf_export_params(control_id, client_name):
+    encoded_name = urllib.parse.quote(f"Account statement: {client_name}")
+    return {
+        'Culture': '1033', 'CultureOverrides': 'True', 'UICulture': '1033', 'UICultureOverrides': 'True',
+        'ReportStack': '1', 'ControlID': control_id, 'Mode': 'true', 'OpType': 'Export',
+        'FileName': encoded_name, 'ContentDisposition': 'OnlyHtmlInline', 'Format': 'PDF'
+    }
+
+def get_report_id(session, agency_id, report_token, transactions_list, from_date='01/01/2025', to_date=''):
+    gen_payload = report_payload(agency_id, report_token, transactions_list, from_date, to_date)
+    response = call(session, 'report', data=gen_payload)
+    if response.status_code == 200: return extract_report_id(response.text)
+    return None
+
+def get_control_id_and_download_pdf(session, report_id, client_name, client_id, final_filename, progress_callback=None, stop_event=None):
+    try:
+        report_view_response = call(session, 'viewer', params={'id': report_id})
+        control_id = extract_control_id(report_view_response.text)
+        if not control_id: return False
+        download_params = pdf_export_params(control_id, client_name)
+        
+        return download_to_file(session, 'pdf', final_filename, download_params, progress_callback, stop_event)
+    except: return False
+
+def _read_part_meta(part):
+    try:
+        with open(part + '.json', 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError): return {}
+
+def _write_part_meta(part, meta):
+    try:
+        with open(part + '.json', 'w', encoding='utf-8') as f: json.dump(meta, f)
+    except OSError: pass
+
+def _discard_part(part):
+    for path in (part, part + '.json'):
+        try: os.remove(path)
+        except OSError: pass
+
+def has_pdf_trailer(filename):
+    # %%EOF يكون ضمن آخر 1024 بايت في ملف PDF مكتمل
+    try:
+        with open(filename, 'rb') as f:
+            f.seek(max(0, os.path.getsize(filename) - 1024))
+            return b'%%EOF' in f.read()
+    except OSError: return False
+
+def part_request_headers(part, meta, same_url):
+    """(الإزاحة، ترويسات Range/If-Range) لاستئناف ملف .part إن أمكن"""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    validator = meta.get('etag') or meta.get('last_modified')
+    headers = {}
+    if offset and (same_url or validator):
+        headers['Range'] = f'bytes={offset}-'
+        if validator: headers['If-Range'] = validator
+    return offset, headers
+
+def finalize_part(part, final_filename, downloaded, expected):
+    """None: ناقص ويُستأنف؛ True: سليم ونُقل ذرياً؛ False: تالف وحُذف"""
+    if expected and downloaded < expected: return None
+    if (expected and downloaded != expected) or not has_pdf_trailer(part):
+        _discard_part(part); return False
+    os.replace(part, final_filename)
+    _discard_part(part)
+    return True
+
+def download_to_file(session, endpoint, final_filename, params=None, progress_callback=None, stop_event=None,
+                     chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=None, attempts=DOWNLOAD_RESUME_ATTEMPTS):
+    """
+    تنزيل إلى ملف مؤقت (.part) ثم نقله ذرياً إلى final_filename بعد التحقق من
+    Content-Length ووجود %%EOF. عند انقطاع الاتصال يُستأنف التنزيل بـ Range،
+    وبين التشغيلات فقط إذا أرسل الخادم ETag/Last-Modified للتحقق عبر If-Range.
+    الملف المكتمل لا يظهر أبداً مقطوعاً.
+    """
+    os.makedirs(os.path.dirname(final_filename) or '.', exist_ok=True)
+    part = final_filename + '.part'
+    meta = _read_part_meta(part)
+    same_url = False
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    for _ in range(max(1, attempts)):
+        offset, headers = part_request_headers(part, meta, same_url)
+        started = time.monotonic()
+        try:
+            with call(session, endpoint, headers=headers, params=params, stream=True,
+                      timeout=timeout or ENDPOINTS[endpoint].timeout) as response:
+                if response.status_code == 416:
+                    _discard_part(part); meta = {}; continue
+                if response.status_code == 206 and 'Range' in headers:
+                    mode, downloaded = 'ab', offset
+                elif response.status_code == 200:
+                    mode, downloaded = 'wb', 0
+                else: return False
+                same_url = response.headers.get('accept-ranges', '').lower() == 'bytes'
+                encoded = response.headers.get('content-encoding', 'identity').lower() != 'identity'
+                length = int(response.headers.get('content-length', 0) or 0)
+                total_size = downloaded + length if length and not encoded else 0
+                if mode == 'wb':
+                    meta = {'etag': response.headers.get('etag'), 'last_modified': response.headers.get('last-modified'), 'total': total_size}
+                    _write_part_meta(part, meta)
+                response.raw.decode_content = True
+                with open(part, mode) as f:
+                    while True:
+                        if stop_event and stop_event.is_set(): return False
+                        n = response.raw.readinto(buf)
+                        if not n: break
+                        f.write(view[:n]); downloaded += n
+                        if progress_callback: progress_callback(downloaded, total_size)
+                observe_transfer(session, 'pdf_transfer', time.monotonic() - started, downloaded - (offset if mode == 'ab' else 0))
+            done = finalize_part(part, final_filename, downloaded, total_size or meta.get('total') or 0)
+            if done is not None: return done
+        except (requests.RequestException, urllib3.exceptions.HTTPError, OSError):
+            continue
+    return False
+
+def parse_balance(data):
+    # [span_3](start_span)Extract TotalBalance directly from the JSON root[span_3](end_span)
+    # Example: "TotalBalance": "22,835.03"
+    return format_balance(data.get('TotalBalance', '0.00'))
+
+def format_balance(raw_balance):
+    # قوائم الخادم قد تعيد الرصيد رقماً بدلاً من نص منسق
+    if isinstance(raw_balance, (int, float)): raw_balance = f"{raw_balance:,.2f}"
+    
+    # Clean string for float conversion
+    clean_balance = str(raw_balance).replace(',', '')
+    try:
+        f_val = float(clean_balance)
+    except:
+        f_val = 0.0
+    
+    # Format nicely with SAR
+    formatted_balance = f"SAR {raw_balance}"
+    return formatted_balance, f_val
+
+# -[span_0](start_span)[span_1](start_span)-- FIXED BALANCE FUNCTION (Using GetAccountStatement)[span_0](end_span)[span_1](end_span) ---
+def account_statement_params(agency_id, from_date='01/01/2025', to_date=''):
+    # Parameters matched from [40] request
+    return {
+        'AgencyId': agency_id,
+        'HotelId': 'null',
+        'OperationType': '',
+        'BookingStatus': '3',
+        'RoomStatus': '2',
+        'PostingStatus': '',
+        'PaymentStatus': '',
+        'findBy': '0',
+        'fromDate': from_date,
+        'toDate': to_date,
+        'CurrencyId': '',
+        'AmountTypeSelected': '1',
+        'Amount': '',
+        'HidePreviousBalance': 'false',
+        'DisplayBookingDateSelected': '0',
+        'GroupByDocNumber': 'false'
+    }
+
+def get_account_statement(session, agency_id, from_date='01/01/2025', to_date=''):
+    """JSON كشف الحساب من GetAccountStatement (يحتوي TotalBalance وصفوف الحركات)"""
+    params = account_statement_params(agency_id, from_date, to_date)
+
+    try:
+        # Using the correct endpoint that returns TotalBalance JSON
+        # (ترويسات Ajax و Referer الضرورية لـ ASP.NET MVC معرفة في ENDPOINTS)
+        response = call(session, 'account_statement', params=params)
+        
+        if response.status_code == 200:
+            return response.json()
+            
+    except Exception as e:
+        print(f"Balance Fetch Error for {agency_id}: {e}")
+    
+    return None
+
+def get_customer_balance(session, agency_id, from_date='01/01/2025'):
+    """
+    جلب الرصيد من نقطة النهاية الصحيحة التي تحتوي على TotalBalance
+    """
+    data = get_account_statement(session, agency_id, from_date)
+    return parse_balance(data) if data is not None else ("N/A", 0.0)
+
+def resolve_client_balance(session, client_id, from_date):
+    balance_raw, balance_float = get_customer_balance(session, client_id, from_date)
+    return balance_raw, balance_float
+
+class BulkBalanceResolver:
+    """
+    أرصدة كل العملاء من قائمة GetCustomerFinancialStatus (بضع صفحات من 500 صف)
+    بدلاً من طلب GetAccountStatement لكل عميل. resolve() بنفس توقيع
+    resolve_client_balance، والعميل غير الموجود في القائمة يُجلب رصيده منفرداً.
+    """
+
+    def __init__(self):
+        self.balances = None
+        self._lock = Lock()
+
+    def prefetch(self, session):
+        with self._lock:
+            if self.balances is not None: return self.balances
+            balances, names = {}, {}
+            rows, complete = fetch_customer_status_rows(session)
+            for c in rows:
+                cid = str(c.get('CustomerId', ''))
+                if not cid: continue
+                if c.get('CustomerName'): names[cid] = c['CustomerName']
+                raw = next((c[k] for k in BALANCE_KEYS if c.get(k) not in (None, '')), None)
+                if raw is not None: balances[cid] = format_balance(raw)
+            # نفس القائمة تحدّث دليل العملاء مجاناً
+            if names:
+                try: open_customer_store().sync(names, complete=complete)
+                except Exception: pass
+            self.balances = balances
+            return balances
+
+    def resolve(self, session, client_id, from_date):
+        balances = self.prefetch(session)
+        hit = balances.get(str(client_id))
+        return hit if hit else resolve_client_balance(session, client_id, from_date)
+
+def resolve_client_statement(session, client_id, from_date, to_date=''):
+    """
+    الرصيد وقائمة الحركات من نفس طلب GetAccountStatement بدلاً من تحميل صفحة
+    كشف الحساب. الرصيد محسوب دائماً حتى اليوم، لذلك مع تاريخ نهاية نحتاج طلباً ثانياً.
+    """
+    data = get_account_statement(session, client_id, from_date)
+    balance_raw, balance_float = parse_balance(data) if data is not None else ("N/A", 0.0)
+    if to_date: data = get_account_statement(session, client_id, from_date, to_date)
+    return balance_raw, balance_float, extract_transactions_from_statement(data)
+
+def transactions_fingerprint(transactions_list):
+    return hashlib.sha1(transactions_list.encode('utf-8')).hexdigest()
+
+class StatementManifest:
+    """
+    سجل الكشوفات المنزّلة بجانب مجلد الحفظ، مفتاحه (الوكالة، من، إلى) ويحفظ بصمة
+    قائمة الحركات. إذا لم تتغير الحركات والملف موجود بنفس الحجم نتخطى التوليد والتنزيل.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self._lock = Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: self.entries = json.load(f)
+        except (OSError, ValueError): self.entries = {}
+
+    @staticmethod
+    def key(agency_id, from_date, to_date):
+        return f"{agency_id}|{from_date}|{to_date}"
+
+    def lookup(self, agency_id, from_date, to_date, tx_hash, filename):
+        entry = self.entries.get(self.key(agency_id, from_date, to_date))
+        if not entry or entry.get('tx_hash') != tx_hash or entry.get('file') != os.path.basename(filename): return False
+        try: return os.path.getsize(filename) == entry.get('size')
+        except OSError: return False
+
+    def record(self, agency_id, from_date, to_date, tx_hash, filename):
+        try: size = os.path.getsize(filename)
+        except OSError: return
+        with self._lock:
+            self.entries[self.key(agency_id, from_date, to_date)] = {
+                'tx_hash': tx_hash, 'file': os.path.basename(filename), 'size': size, 'time': time.time()}
+            self._save()
+
+    def refresh(self, filename):
+        """بعد ضغط الملف في postprocess: الحجم الجديد لكل مدخل يشير إليه"""
+        try: size = os.path.getsize(filename)
+        except OSError: return
+        with self._lock:
+            for entry in self.entries.values():
+                if entry.get('file') == os.path.basename(filename): entry['size'] = size
+            self._save()
+
+    def _save(self):
+        # يُستدعى مع self._lock؛ ملف مؤقت ثم نقل ذري
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.entries, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError: pass
+
+def statement_filename(output_dir, client_name, client_id):
+    safe_name = re.sub(r'[<>:"/\\|?*]', '_', client_name)[:50]
+    return os.path.join(output_dir, f"{safe_name}_Statement_{client_id}.pdf")
+
+def _new_report(session, job):
+    rid = get_report_id(session, job['client_id'], job['report_token'], job['transactions'], job['from_date'], job['to_date'])
+    if rid and job['journal']: job['journal'].record(job['client_id'], 'report', report_id=rid, report_t=time.time(), tx_hash=job['tx_hash'])
+    return rid
+
+def prepare_statement(session, client_id, client_name, output_dir, from_date, to_date, report_token, stop_event=None, manifest=None, transactions=None, journal=None):
+    """
+    المرحلة الأولى: الحركات ثم توليد التقرير على الخادم (حتى 300 ثانية).
+    يعيد (ok, msg, job): job جاهز لـ download_statement، أو None إذا انتهى العميل هنا.
+    """
+    if stop_event and stop_event.is_set(): return False, "Cancelled", None
+    # الحركات تأتي عادة من resolve_client_statement، والصفحة فقط عند عدم توفرها
+    txs = transactions if transactions is not None else fetch_statement_transactions(session, client_id)
+    if txs is None: return False, "Statement failed", None
+    final_filename = statement_filename(output_dir, client_name, client_id)
+    tx_hash = transactions_fingerprint(txs) if manifest is not None or journal else None
+    if tx_hash and manifest.lookup(client_id, from_date, to_date, tx_hash, final_filename):
+        if journal: journal.record_done(client_id, final_filename, "Unchanged")
+        return True, "Unchanged", None
+    job = {'client_id': client_id, 'client_name': client_name, 'final_filename': final_filename, 'transactions': txs,
+           'tx_hash': tx_hash, 'from_date': from_date, 'to_date': to_date, 'report_token': report_token,
+           'manifest': manifest, 'journal': journal}
+    # رقم تقرير من تشغيل سابق متوقف يوفر إعادة التوليد إذا بُني من نفس الحركات؛
+    # إذا انتهت صلاحيته على الخادم نولّد من جديد
+    job['reused'] = journal.report_id(client_id, tx_hash) if journal else None
+    job['report_id'] = job['reused'] or _new_report(session, job)
+    if not job['report_id']: return False, "Report failed", None
+    return True, "", job
+
+def download_statement(session, job, progress_callback=None, stop_event=None):
+    """المرحلة الثانية: ControlID من Viewer.aspx ثم تنزيل ملف PDF"""
+    client_id, final_filename = job['client_id'], job['final_filename']
+    ok = get_control_id_and_download_pdf(session, job['report_id'], job['client_name'], client_id, final_filename, progress_callback, stop_event)
+    if not ok and job['reused'] and not (stop_event and stop_event.is_set()):
+        job['reused'], job['report_id'] = None, _new_report(session, job)
+        if not job['report_id']: return False, "Report failed"
+        ok = get_control_id_and_download_pdf(session, job['report_id'], job['client_name'], client_id, final_filename, progress_callback, stop_event)
+    if ok:
+        if job['manifest'] and job['tx_hash']: job['manifest'].record(client_id, job['from_date'], job['to_date'], job['tx_hash'], final_filename)
+        if job['journal']: job['journal'].record_done(client_id, final_filename)
+        return True, f" "
+    return False, "Download failed"
+
+def download_single_pdf(session, client_id, client_name, output_dir, from_date, to_date, report_token, progress_callback=None, stop_event=None, manifest=None, transactions=None, journal=None):
+    try:
+        ok, msg, job = prepare_statement(session, client_id, client_name, output_dir, from_date, to_date, report_token, stop_event, manifest, transactions, journal)
+        if job is None: return ok, msg
+        return download_statement(session, job, progress_callback, stop_event)
+    except Exception as e: return False, str(e)
+
+def parse_client_ids(input_str):
+    return [id.strip() for id in input_str.replace('\n', ' ').replace(',', ' ').split() if id.strip()]
+
+def retry_policy(post=False):
+    """
+    إعادة المحاولة عند 429/5xx مع احترام Retry-After. POST لا يُعاد افتراضياً،
+    باستثناء ReportAccountStatement الذي يمكن تكراره بأمان بالنسبة لنا.
+    """
+    methods = Retry.DEFAULT_ALLOWED_METHODS | {'POST'} if post else Retry.DEFAULT_ALLOWED_METHODS
+    # ObservedRetry: المحدد يرى أيضاً الردود المعادة داخلياً مع Retry-After الخاص بها
+    return ObservedRetry(total=3, backoff_factor=1, status_forcelist=RETRY_STATUSES, allowed_methods=methods,
+                 respect_retry_after_header=True, raise_on_status=False)
+
+# سياسات خاصة لكل نقطة نهاية (البادئة الأطول هي التي تُطبق)
+ENDPOINT_RETRY_POLICIES = {
+    REPORT_GEN_POST: lambda: retry_policy(post=True),
+}
+
+def create_session_with_retry():
+    session = requests.Session()
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, HTTPAdapter(max_retries=retry_policy(), pool_maxsize=POOL_SIZE))
+    for path, policy in ENDPOINT_RETRY_POLICIES.items():
+        session.mount(BASE_URL + path, HTTPAdapter(max_retries=policy(), pool_maxsize=POOL_SIZE))
+    session.headers.update(BASE_HEADERS)
+    return session
+
+class SessionManager:
+    """
+    جلسة واحدة مسجلة الدخول تُوزع على العمال المتوازيين:
+    - start(): تجربة الكوكيز المحفوظة بطلب خفيف (صفحة الحالة المالية، وهي نفسها مصدر
+      رمز التقرير) وتسجيل الدخول فقط إذا انتهت صلاحيتها.
+    - acquire(): نفس الجلسة ومجمع اتصالاتها لكل الخيوط (الترويسات لكل طلب من ENDPOINTS)؛
+      لكل خيط فقط رقم تسجيل الدخول الذي بدأ به. تحويل لصفحة الدخول في أي خيط (ومنها
+      خيوط sharding) يُعلّم ذلك التسجيل كله منتهياً.
+    - refresh(): إعادة تسجيل الدخول مرة واحدة فقط مهما كان عدد العمال الذين لاحظوا الانتهاء.
+    """
+
+    def __init__(self, username, password, cookie_file=SESSION_FILE):
+        self.username, self.password, self.cookie_file = username, password, cookie_file
+        self.session = create_session_with_retry()
+        self.report_token = ""
+        self.generation = 0
+        self.expired_generation = None
+        self._lock = Lock()
+        self._local = local()
+        self.session.hooks['response'].append(self._watch)
+
+    def probe(self, session=None):
+        """رمز التقرير إذا كانت الجلسة صالحة، وإلا None"""
+        session = session or self.session
+        try:
+            response = call(session, 'token_page', allow_redirects=False)
+            if response.status_code != 200 or is_login_redirect(response): return None
+            return extract_report_token(response.text)
+        except requests.RequestException: return None
+
+    def _login(self):
+        # الدخول على جلسة منفصلة ثم نسخ الكوكيز: طلبات الخيوط الأخرى الجارية على الجلسة
+        # المشتركة لا ترى جرة كوكيز فارغة أثناء تسجيل الدخول
+        fresh = create_session_with_retry()
+        try:
+            if not perform_full_login(fresh, self.username, self.password): return False
+            self.session.cookies.update(fresh.cookies)
+        finally: fresh.close()
+        self.report_token = self.probe() or ""
+        save_session_cookies(self.session, self.cookie_file, self.username)
+        return True
+
+    def start(self):
+        with self._lock:
+            if load_session_cookies(self.session, self.cookie_file, self.username):
+                token = self.probe()
+                if token is not None:
+                    self.report_token = token
+                    return True
+            return self._login()
+
+    def acquire(self):
+        """الجلسة المشتركة؛ يحفظ لهذا الخيط رقم آخر تسجيل دخول"""
+        self._local.generation = self.generation
+        return self.session
+
+    def _watch(self, response, *args, **kwargs):
+        # الـ hook يعمل في خيط الطلب، وقد يكون خيطاً داخلياً (أجزاء sharding)؛ لذلك
+        # الانتهاء قيمة على تسجيل الدخول نفسه وليس على الخيط
+        if is_login_redirect(response): self.expired_generation = self.generation
+
+    def is_expired(self, session=None):
+        """هل انتهى تسجيل الدخول الذي بدأ به هذا الخيط (رآه هو أو أي خيط آخر)"""
+        if self.expired_generation is None: return False
+        return self.expired_generation >= getattr(self._local, 'generation', self.generation)
+
+    def refresh(self, generation=None):
+        """single-flight: إذا سبقنا عامل آخر بإعادة الدخول نستخدم جلسته الجديدة فقط"""
+        if generation is None: generation = getattr(self._local, 'generation', self.generation)
+        with self._lock:
+            # تسجيل دخول أحدث من الذي بدأ به العامل ولم يُرَ منتهياً بعد
+            if generation != self.generation and self.expired_generation != self.generation: return True
+            if not self._login(): return False
+            self.generation += 1
+            return True
+
+def prepare_client(session, cid, name, out_dir, from_date, to_date, report_token, stop_event=None, manifest=None, journal=None):
+    """الرصيد والحركات وتوليد التقرير: (row, job) و job هو None إذا لا يوجد ما يُنزّل"""
+    bal_raw, bal_float, txs = resolve_client_statement(session, cid, from_date, to_date)
+    row = {'id': cid, 'name': name, 'balance': bal_raw, 'balance_float': bal_float}
+    if journal: journal.record(cid, 'balance', name=name, balance=bal_raw, balance_float=bal_float)
+    try: ok, msg, job = prepare_statement(session, cid, name, out_dir, from_date, to_date, report_token, stop_event, manifest, txs, journal)
+    except Exception as e: ok, msg, job = False, str(e), None
+    if job is None:
+        if ok and msg == "Unchanged": row['file'] = statement_filename(out_dir, name, cid)
+        _finish_row(row, ok, msg, journal)
+    return row, job
+
+def complete_client(session, row, job, on_progress=None, stop_event=None):
+    prog = (lambda cur, tot: on_progress(row, cur, tot)) if on_progress else None
+    # بعد الإيقاف لا نفتح العارض ولا تدفق PDF؛ والتنزيل المقطوع إلغاء وليس فشلاً
+    if stop_event and stop_event.is_set(): return _finish_row(row, False, "Cancelled", job['journal'])
+    try: ok, msg = download_statement(session, job, prog, stop_event)
+    except Exception as e: ok, msg = False, str(e)
+    if not ok and stop_event and stop_event.is_set(): msg = "Cancelled"
+    if ok: row['file'] = job['final_filename']
+    return _finish_row(row, ok, msg, job['journal'])
+
+def _finish_row(row, ok, msg, journal):
+    row['ok'], row['msg'] = ok, msg
+    if journal and not ok and msg != "Cancelled": journal.record(row['id'], 'failed', msg=msg)
+    return row
+
+def process_client(session, cid, name, out_dir, from_date, to_date, report_token, on_progress=None, stop_event=None, manifest=None, journal=None):
+    row, job = prepare_client(session, cid, name, out_dir, from_date, to_date, report_token, stop_event, manifest, journal)
+    return complete_client(session, row, job, on_progress, stop_event) if job else row
+
+def balance_only_client(session, cid, name, from_date, resolver):
+    bal_raw, bal_float = resolver.resolve(session, cid, from_date)
+    return {'id': cid, 'name': name, 'balance': bal_raw, 'balance_float': bal_float, 'ok': bal_raw != "N/A", 'msg': ""}
+
+def run_batch(session, client_ids, customers, out_dir, from_date, to_date, report_token,
+              concurrency=DEFAULT_CONCURRENCY, on_start=None, on_progress=None, on_done=None, stop_event=None,
+              skip_unchanged=True, balances_only=False, session_manager=None, rate_limiter=None, resume=True,
+              download_workers=0, summary=None, metrics=None, shard_period=None, postprocess=None):
+    """
+    معالجة قائمة العملاء بمجموعة عمال محدودة العدد.
+    النتائج تُعاد بنفس ترتيب المدخلات بحيث يبقى الملخص والإجمالي كما هو في الوضع التسلسلي.
+    مع skip_unchanged يُتخطى العميل الذي لم تتغير حركاته منذ آخر تنزيل لنفس الفترة.
+    مع balances_only تُجلب الأرصدة فقط دفعة واحدة عبر BulkBalanceResolver بدون كشوفات.
+    مع session_manager يأخذ كل عامل جلسته منه، وإذا انتهت الجلسة أثناء الدفعة يُعاد
+    تسجيل الدخول مرة واحدة ويُعاد العميل الفاشل بدلاً من فشل كل العملاء التالين.
+    الفاصل بين العملاء يحدده AdaptiveRateLimiter مشترك بين العمال حسب استجابة الخادم.
+    مع resume تُسجل حالة كل عميل في JobJournal، والدفعة المتوقفة تكمل من حيث توقفت.
+
+    مع download_workers > 0 تعمل الدفعة كخط إنتاج من مرحلتين: concurrency عامل يولّدون
+    التقارير على الخادم، و download_workers عامل ينزّلون الملفات الجاهزة من طابور محدود
+    (إذا تأخر التنزيل يتوقف التوليد مؤقتاً). هكذا يعمل الخادم والشبكة في نفس الوقت.
+
+    مع summary (SummaryWriter) يُكتب صف كل عميل في الملخص فور انتهائه.
+    مع metrics (RunMetrics) يُقاس زمن كل طلب ويُنسب للعميل الذي يعمل عليه الخيط.
+    مع shard_period ('month' / 'quarter' / 'year') يُقسم كشف كل عميل إلى فترات تُولّد
+    وتُنزّل بالتوازي ثم تُدمج (sharding.py)، بدون سجل التخطي والاستئناف.
+    مع postprocess (postprocess.PostProcessor) يبدأ ضغط كل PDF وإضافته لـ ZIP فور انتهائه.
+    """
+    total = len(client_ids)
+    manifest = StatementManifest(out_dir) if skip_unchanged and not balances_only else None
+    resolver = BulkBalanceResolver() if balances_only else None
+    if resolver: resolver.prefetch(session)
+    concurrency = max(1, min(int(concurrency or 1), MAX_CONCURRENCY, total or 1))
+    download_workers = 0 if balances_only else max(0, min(int(download_workers or 0), MAX_CONCURRENCY))
+    results = [None] * total
+    started = {}
+    limiter = None if balances_only else (rate_limiter or AdaptiveRateLimiter())
+    journal = JobJournal(out_dir, from_date, to_date) if resume and not balances_only else None
+    jobs = Queue(maxsize=download_workers * PIPELINE_QUEUE_FACTOR) if download_workers else None
+    # أجزاء sharding لكل العملاء معاً لا تتجاوز ما يبقى من مجمع الاتصالات بعد العمال
+    shard_slots = BoundedSemaphore(max(1, POOL_SIZE - concurrency)) if shard_period else None
+
+    def worker_session():
+        # كل العمال يتشاركون نفس الجلسة ومجمع اتصالاتها (لا أحد يعدل session.headers)
+        sess = session_manager.acquire() if session_manager else session
+        if metrics: metrics.attach(sess)
+        return limiter.attach(sess) if limiter else sess
+
+    def with_relogin(step):
+        # عند انتهاء الجلسة: إعادة دخول واحدة مشتركة ثم إعادة نفس الخطوة
+        result = step(worker_session())
+        for _ in range(RELOGIN_ATTEMPTS if session_manager else 0):
+            row = result[0] if isinstance(result, tuple) else result
+            if row['ok'] or not session_manager.is_expired() or not session_manager.refresh(): break
+            # worker_session وليس acquire: الإعادة تمر أيضاً بالمحدد وقياس الأزمنة
+            result = step(worker_session())
+        return result
+
+    def finish(idx, row):
+        if idx in started: row['seconds'] = time.monotonic() - started.pop(idx)
+        results[idx - 1] = row
+        if summary: summary.add(idx, row)
+        if postprocess: postprocess.add(idx, row, manifest, journal)
+        if on_done: on_done(idx, total, row)
+
+    def progress_for(idx):
+        return (lambda row, cur, tot: on_progress(idx, total, row, cur, tot)) if on_progress else None
+
+    def handle(idx, cid):
+        if stop_event and stop_event.is_set(): return
+        done = journal.completed_row(cid) if journal else None
+        if done: return finish(idx, done)
+        if limiter and not limiter.acquire(stop_event): return
+        name = get_client_name_from_dict(cid, customers)
+        started[idx] = time.monotonic()
+        if metrics: metrics.set_client(cid)
+        if on_start: on_start(idx, total, cid, name)
+        if resolver: return finish(idx, with_relogin(lambda sess: balance_only_client(sess, cid, name, from_date, resolver)))
+        if shard_period:
+            from sharding import process_sharded_client
+            token = session_manager.report_token if session_manager else report_token
+            return finish(idx, with_relogin(lambda sess: process_sharded_client(
+                sess, cid, name, out_dir, from_date, to_date, token, progress_for(idx), stop_event, shard_period,
+                slots=shard_slots)))
+
+        def prepare(sess):
+            token = session_manager.report_token if session_manager else report_token
+            row, job = prepare_client(sess, cid, name, out_dir, from_date, to_date, token, stop_event, manifest, journal)
+            # فشل المرحلة الأولى يظهر في الصف؛ النجاح (job) يُعامل كنجاح لغرض إعادة الدخول
+            return (dict(row, ok=True) if job else row), (row, job)
+
+        row, job = with_relogin(prepare)[1]
+        if job is None: return finish(idx, row)
+        if jobs is not None: enqueue((idx, row, job))  # ينتظر إذا امتلأ الطابور
+        else: download(idx, row, job)
+
+    def download(idx, row, job):
+        if metrics: metrics.set_client(row['id'])
+        finish(idx, with_relogin(lambda sess: complete_client(sess, row, job, progress_for(idx), stop_event)))
+
+    def safe_download(idx, row, job):
+        # خطأ في on_done / summary / postprocess لا يوقف المنزّل ولا يترك العميل بلا نتيجة
+        try: download(idx, row, job)
+        except Exception as e:
+            if results[idx - 1] is not None: return
+            failed = dict(row, ok=False, msg=str(e))
+            try: finish(idx, failed)
+            except Exception: results[idx - 1] = failed
+
+    def download_stage():
+        # بعد الإيقاف يستمر تفريغ الطابور (حتى لا ينتظر enqueue) لكن complete_client ينهي كل عنصر كـ Cancelled
+        while True:
+            item = jobs.get()
+            if item is None: return
+            safe_download(*item)
+
+    def enqueue(item):
+        # لا ننتظر طابوراً ممتلئاً للأبد إذا لم يبق منزّل حي
+        while True:
+            try: return jobs.put(item, timeout=PIPELINE_POLL_SECONDS)
+            except Full:
+                if any(t.is_alive() for t in downloaders): continue
+                if item is not None: safe_download(*item)
+                return
+
+    downloaders = [Thread(target=download_stage, daemon=True) for _ in range(download_workers)]
+    for t in downloaders: t.start()
+    try:
+        if concurrency == 1:
+            for idx, cid in enumerate(client_ids, 1):
+                if stop_event and stop_event.is_set(): break
+                handle(idx, cid)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for f in [pool.submit(handle, idx, cid) for idx, cid in enumerate(client_ids, 1)]: f.result()
+    finally:
+        for _ in downloaders: enqueue(None)
+        for t in downloaders: t.join()
+    if journal and not (stop_event and stop_event.is_set()): journal.finish()
+    return [r for r in results if r is not None]
@@ -0,0 +1,71 @@
+"""
+زمن fix_text لكل استدعاء على رسائل الحالة المعتادة: التشكيل الكامل في كل مرة
+(السلوك السابق) مقابل arabic_text.fix_text (ذاكرة مؤقتة + قوالب الأرقام).
+
+الاستخدام:
+    python benchmarks/bench_arabic.py [--clients 200]
+
+يحتاج arabic-reshaper و python-bidi (بدونهما لا يوجد تشكيل لقياسه).
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arabic_text  # noqa: E402
+from arabic_text import fix_text, shape  # noqa: E402
+
+
+PREFIXES = ["وكالة", "شركة", "مؤسسة", "مكتب", "مجموعة", "دار", "رحلات"]
+NAMES = ["النخيل", "الرياض", "الحرمين", "السلام", "الفجر", "المدينة", "الأمل", "النور", "الخليج", "الصفوة", "البيان",
+         "الريان", "الوفاء", "الهدى", "القمة", "الواحة", "الأصيل", "المسار", "الإتقان", "الضيافة", "الماسة", "السفير",
+         "الجزيرة", "الرحاب", "اليمامة", "الشروق", "الأندلس", "التيسير", "الدانة"]
+
+
+def status_lines(clients):
+    """نفس الرسائل التي يرسلها download_thread أثناء دفعة بهذا العدد"""
+    for idx in range(1, clients + 1):
+        # أسماء مختلفة بدون أرقام كما في دليل العملاء (كل عميل قالب جديد)
+        name = f"{PREFIXES[idx % len(PREFIXES)]} {NAMES[idx % len(NAMES)]} {NAMES[idx // len(NAMES) % len(NAMES)]} للسياحة"
+        balance = f"SAR {idx * 1234.5:,.2f}"
+        yield f"جاري معالجة: {name}"
+        for pct in range(0, 101, 2):
+            yield f"[{idx}/{clients}] {name} - المستحق: {balance} - جاري التحميل: {pct}%"
+        yield f"[{idx}/{clients}] {name} - المستحق: {balance} -  "
+    yield f"الإجمالي: SAR {clients * 99999.5:,.2f}"
+
+
+def per_call(fn, lines):
+    start = time.perf_counter()
+    for line in lines: fn(line)
+    return (time.perf_counter() - start) / len(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-call cost of Arabic shaping on status strings.")
+    parser.add_argument('--clients', type=int, default=200)
+    args = parser.parse_args(argv)
+    if not (arabic_text.ARABIC_RESHAPER_AVAILABLE and arabic_text.BIDI_LIBS_AVAILABLE):
+        print("arabic-reshaper / python-bidi not installed: nothing to measure"); return 1
+
+    lines = list(status_lines(args.clients))
+    mismatches = sum(1 for line in lines[:2000] if fix_text(line) != shape(line))
+    arabic_text._shape_text.cache_clear(); arabic_text._shape_template.cache_clear()
+
+    before = per_call(shape, lines)
+    cold = per_call(fix_text, lines)   # أول مرور: القالب يُشكّل مرة لكل عميل
+    warm = per_call(fix_text, lines)   # نفس الرسائل مرة أخرى (إعادة رسم السجل)
+    print(f"{len(lines)} status strings, {args.clients} clients")
+    print(f"  reshape + bidi every call  {before * 1e6:8.1f} us/call")
+    print(f"  fix_text (first pass)      {cold * 1e6:8.1f} us/call  x{before / cold:.1f}")
+    print(f"  fix_text (repeated)        {warm * 1e6:8.1f} us/call  x{before / warm:.1f}")
+    for name, info in arabic_text.cache_info().items():
+        print(f"  {name} cache: {info.hits} hits, {info.misses} misses, {info.currsize}/{info.maxsize}")
+    if mismatches: print(f"  MISMATCH: {mismatches} strings shaped differently"); return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
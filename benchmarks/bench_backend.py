@@ -0,0 +1,172 @@
+"""
+قياس أداء backend كاملاً مقابل benchmarks/replay_server.py (بدون لمس الموقع الحقيقي).
+
+السيناريوهات: مسار download_single_pdf لعميل واحد (وسيط عدة تكرارات)، ثم دفعات
+run_batch بالأحجام المطلوبة. لكل سيناريو: الزمن، العملاء في الثانية، زمن المعالج
+لهذه العملية فقط (الخادم في عملية منفصلة) وأعلى ذاكرة RSS أثناءه.
+
+الاستخدام:
+    python benchmarks/bench_backend.py --sizes 10,100,1000 --concurrency 4
+    python benchmarks/bench_backend.py --save baseline.json
+    python benchmarks/bench_backend.py --baseline baseline.json --tolerance 0.15   # بوابة انحدار: exit 1
+
+خيارات الخادم (--latency، --jitter، --error-rate، --report-latency، --pdf-kb) تُمرر له كما هي.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import subprocess
+from threading import Thread, Event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SERVER_SCRIPT = os.path.join(ROOT, 'benchmarks', 'replay_server.py')
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend against the local replay server.")
+    parser.add_argument('--sizes', default='10,100,1000', help="batch sizes, comma separated")
+    parser.add_argument('--repeat', type=int, default=5, help="single-client flow repetitions")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--download-workers', type=int, default=0)
+    parser.add_argument('--rate', type=float, default=200.0, help="rate limiter requests/s (the default 2/s would measure the limiter)")
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--report-latency', type=float, default=0.2)
+    parser.add_argument('--pdf-kb', type=int, default=256)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--save', help="write results to this JSON file (a baseline for later runs)")
+    parser.add_argument('--baseline', help="compare throughput with a saved run and exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed throughput drop against --baseline")
+    return parser.parse_args(argv)
+
+
+def start_server(args, customers):
+    cmd = [sys.executable, SERVER_SCRIPT, '--port', '0', '--latency', str(args.latency), '--jitter', str(args.jitter),
+           '--error-rate', str(args.error_rate), '--report-latency', str(args.report_latency),
+           '--pdf-kb', str(args.pdf_kb), '--customers', str(customers), '--seed', '1']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith('listening on '):
+        proc.kill()
+        raise RuntimeError(f"replay server did not start: {line!r}")
+    return proc, line.split(' ', 2)[2]
+
+
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Measure:
+    """زمن الساعة وزمن المعالج وأعلى RSS (بعينات دورية) لكتلة with"""
+
+    def __enter__(self):
+        self.peak_rss, self._stop = current_rss(), Event()
+        self._sampler = Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL): self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __exit__(self, *exc):
+        self.wall, self.cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        self._stop.set(); self._sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def result(clients, m, rows=None):
+    failed = sum(1 for r in rows if not r['ok']) if rows is not None else 0
+    return {'clients': clients, 'seconds': round(m.wall, 3), 'clients_per_s': round(clients / m.wall, 2) if m.wall else 0,
+            'cpu_s': round(m.cpu, 3), 'peak_rss_mb': round(m.peak_rss / 1e6, 1), 'failed': failed}
+
+
+def run(args, workdir):
+    import backend
+    from ratelimit import AdaptiveRateLimiter
+
+    results = {}
+    manager = backend.SessionManager('bench', 'bench', os.path.join(workdir, 'cookies.json'))
+    with Measure() as m:
+        ok = manager.start()
+        customers = backend.get_all_client_names(manager.session)
+    if not ok: raise RuntimeError("login against the replay server failed")
+    results['login+directory'] = result(1, m)
+
+    times, failures = [], 0
+    for i in range(args.repeat):
+        out = os.path.join(workdir, f'single{i}')
+        with Measure() as m:
+            ok, _ = backend.download_single_pdf(manager.session, '1001', 'Client 1001', out, '01/01/2025', '', manager.report_token)
+        times.append(m); failures += 0 if ok else 1
+    best = sorted(times, key=lambda t: t.wall)[len(times) // 2]
+    results['download_single_pdf'] = dict(result(1, best), failed=failures, median_of=args.repeat)
+
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        ids = [str(1001 + i) for i in range(size)]
+        limiter = AdaptiveRateLimiter(rate=args.rate, max_rate=args.rate, burst=max(1, args.concurrency))
+        with Measure() as m:
+            rows = backend.run_batch(manager.session, ids, customers, os.path.join(workdir, f'batch{size}'), '01/01/2025', '',
+                                     manager.report_token, args.concurrency, skip_unchanged=False, resume=False,
+                                     session_manager=manager, rate_limiter=limiter, download_workers=args.download_workers)
+        results[f'batch_{size}'] = result(size, m, rows)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        now = results.get(name)
+        if not now or not base.get('clients_per_s'): continue
+        if now['clients_per_s'] < base['clients_per_s'] * (1 - tolerance):
+            regressions.append(f"{name}: {now['clients_per_s']} clients/s vs baseline {base['clients_per_s']}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    workdir = tempfile.mkdtemp(prefix='bench_backend_')
+    proc, base_url = start_server(args, max(sizes + [1]) + 10)
+    # backend يقرأ BOOKING_BASE_URL عند الاستيراد، ودليل العملاء والكوكيز في مجلد مؤقت
+    os.environ['BOOKING_BASE_URL'] = base_url
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run(args, workdir)
+    finally:
+        os.chdir(cwd)
+        proc.terminate(); proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'settings': {k: v for k, v in vars(args).items() if k not in ('json', 'save', 'baseline')}, 'results': results}
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print(f"{'scenario':<22}{'clients':>8}{'seconds':>10}{'clients/s':>11}{'cpu s':>9}{'peak MB':>9}{'failed':>8}")
+        for name, r in results.items():
+            print(f"{name:<22}{r['clients']:>8}{r['seconds']:>10.2f}{r['clients_per_s']:>11.2f}{r['cpu_s']:>9.2f}"
+                  f"{r['peak_rss_mb']:>9.1f}{r['failed']:>8}")
+    if args.save:
+        with open(args.save, 'w') as f: json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f: regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions: print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
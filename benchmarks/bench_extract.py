@@ -0,0 +1,89 @@
+"""
+مقارنة استخراج الحقول: BeautifulSoup (html.parser) مقابل html_extract.
+
+الاستخدام:
+    python benchmarks/bench_extract.py [page.html ...]
+
+بدون ملفات تُولّد صفحة كشف حساب اصطناعية كبيرة. يمكن تمرير صفحات
+AccountStatement أو Login مسجلة (بعد إخفاء البيانات) لقياس أدق.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_extract import find_input_value, collect_input_values, scan_chunks  # noqa: E402
+
+try:
+    from bs4 import BeautifulSoup
+    BS4_AVAILABLE = True
+except ImportError:
+    BS4_AVAILABLE = False
+
+REPEAT = 5
+
+
+def synthetic_page(rows=20000):
+    head = ('<html><head><title>Account Statement</title></head><body><form>'
+            '<input name="__RequestVerificationToken" type="hidden" value="CfDJ8N-token-value" />'
+            '<table class="table">')
+    body = ''.join(
+        f'<tr><td><input name="Transactions" type="checkbox" value="{100000 + i}" checked="checked"></td>'
+        f'<td>2025-01-{i % 28 + 1:02d}</td><td>فندق {i}</td><td class="amount">{i * 3.5:,.2f}</td></tr>'
+        for i in range(rows))
+    return head + body + '</table></form></body></html>'
+
+
+def bs4_transactions(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    checkboxes = soup.find_all('input', {'name': 'Transactions', 'type': 'checkbox'})
+    return [cb.get('value') for cb in checkboxes if cb.get('value')]
+
+
+def bs4_token(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    tag = soup.find('input', {'name': '__RequestVerificationToken'})
+    return tag.get('value') if tag else None
+
+
+def streamed_transactions(html_content, chunk=64 * 1024):
+    return scan_chunks((html_content[i:i + chunk] for i in range(0, len(html_content), chunk)), 'Transactions', 'checkbox')
+
+
+def best_of(fn, arg):
+    best, result = float('inf'), None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(name, page):
+    print(f"\n{name}: {len(page) / 1e6:.2f} MB")
+    cases = [
+        ('regex transactions', lambda p: collect_input_values(p, 'Transactions', 'checkbox')),
+        ('streamed transactions', streamed_transactions),
+        ('regex token', lambda p: find_input_value(p, '__RequestVerificationToken')),
+    ]
+    if BS4_AVAILABLE:
+        cases = [('bs4 transactions', bs4_transactions), ('bs4 token', bs4_token)] + cases
+    results = {}
+    for label, fn in cases:
+        seconds, results[label] = best_of(fn, page)
+        print(f"  {label:<24} {seconds * 1000:9.1f} ms")
+    if BS4_AVAILABLE:
+        assert results['bs4 transactions'] == results['regex transactions'] == results['streamed transactions']
+        assert results['bs4 token'] == results['regex token']
+
+
+def main(paths):
+    if not BS4_AVAILABLE: print("beautifulsoup4 not installed: skipping the baseline")
+    if not paths: run('synthetic', synthetic_page())
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f: run(os.path.basename(path), f.read())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,305 @@
+"""
+خادم محلي بديل لموقع joodbooking لقياس أداء backend بدون لمس بيانات الإنتاج.
+
+يجيب على كل نقاط النهاية في backend (الدخول، صفحة الحالة المالية، قائمة العملاء،
+GetAccountStatement، صفحة كشف الحساب، ReportAccountStatement، Viewer.aspx وملف .axd)
+بردود اصطناعية بنفس الشكل، مع تأخير وتذبذب ونسبة أخطاء وحجم PDF قابلة للضبط.
+ردود مسجلة من الموقع (بعد إخفاء البيانات) تُوضع في مجلد --recordings باسم المرحلة
+(login_page.html، token_page.html، statement_page.html، viewer.html، report.txt، statement.pdf)
+فتُعاد كما هي بدل الرد الاصطناعي.
+
+الاستخدام:
+    python benchmarks/replay_server.py --port 8800 --latency 0.05 --error-rate 0.01 --pdf-kb 512
+    BOOKING_BASE_URL=http://127.0.0.1:8800 python cli.py --clients 1001,1002 --output /tmp/out
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import (  # noqa: E402
+    LOGIN_POST, FINANCIAL_STATUS_PAGE, ACCOUNT_STATEMENT_PAGE, GET_ACCOUNT_STATEMENT_API,
+    REPORT_GEN_POST, REPORT_VIEWER_BASE, PDF_AXD_ENDPOINT, CUSTOMER_FINANCIAL_STATUS_GET, DATE_FORMAT,
+)
+
+SESSION_COOKIE = "ReplaySession"
+TOKEN = "CfDJ8-replay-token"
+FIRST_CLIENT_ID = 1001
+SEND_CHUNK = 64 * 1024
+FIRST_TRANSACTION_DATE = date(2025, 1, 1)
+
+
+def synthetic_pdf(size):
+    head, tail = b"%PDF-1.4\n", b"\n%%EOF\n"
+    body = (b"0 0 obj << /Replay true >> endobj\n" * (size // 34 + 1))[:max(0, size - len(head) - len(tail))]
+    return head + body + tail
+
+
+def client_transactions(client_id, count):
+    base = int(client_id) * 1000 if str(client_id).isdigit() else 0
+    return [base + i for i in range(count)]
+
+
+def transaction_date(index):
+    """الحركات موزعة أسبوعياً من FIRST_TRANSACTION_DATE حتى يمكن تقسيمها بالفترات"""
+    return FIRST_TRANSACTION_DATE + timedelta(days=7 * index)
+
+
+def parse_day(text, default):
+    try: return datetime.strptime(text, DATE_FORMAT).date() if text else default
+    except ValueError: return default
+
+
+class ReplayConfig:
+
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0, report_latency=0.2, pdf_kb=256,
+                 customers=1000, transactions=50, bandwidth=0, session_ttl=0, recordings=None, seed=None):
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.report_latency, self.customers, self.transactions = report_latency, customers, transactions
+        self.bandwidth, self.session_ttl = bandwidth, session_ttl
+        self.pdf = synthetic_pdf(pdf_kb * 1024)
+        self.pdf_etag = '"%s"' % hashlib.sha1(self.pdf).hexdigest()
+        self.random = random.Random(seed)
+        self.recordings = {}
+        if recordings:
+            for name in os.listdir(recordings):
+                with open(os.path.join(recordings, name), 'rb') as f:
+                    self.recordings[os.path.splitext(name)[0]] = f.read()
+        if 'statement' in self.recordings:
+            self.pdf = self.recordings['statement']
+            self.pdf_etag = '"%s"' % hashlib.sha1(self.pdf).hexdigest()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ReplayServer/1.0'
+
+    def log_message(self, *args): pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    # --- أدوات الرد ---
+    def send(self, status, body=b'', content_type='text/html; charset=utf-8', headers=None):
+        if isinstance(body, str): body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD': self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send(200, json.dumps(data, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def redirect_to_login(self):
+        self.send(302, headers={'Location': '/Account/Login?ReturnUrl=' + self.path})
+
+    def delay(self, extra=0.0):
+        c = self.config
+        wait = c.latency + extra + c.random.uniform(-c.jitter, c.jitter)
+        if wait > 0: time.sleep(wait)
+
+    def authenticated(self):
+        match = re.search(SESSION_COOKIE + r'=([^;]+)', self.headers.get('Cookie', ''))
+        if not match: return False
+        issued = self.server.sessions.get(match.group(1))
+        if issued is None: return False
+        return not self.config.session_ttl or time.time() - issued < self.config.session_ttl
+
+    def recorded(self, stage):
+        return self.config.recordings.get(stage)
+
+    def read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return parse_qs(self.rfile.read(length).decode('utf-8', 'replace')) if length else {}
+
+    # --- التوجيه ---
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def route(self, method):
+        url = urlsplit(self.path)
+        path, query = url.path.rstrip('/').lower(), parse_qs(url.query)
+        self.server.count(path)
+        form = self.read_form() if method == 'POST' else {}
+        if path == LOGIN_POST.lower():
+            self.delay()
+            return self.login_page() if method == 'GET' else self.login(form)
+        if not self.authenticated(): return self.redirect_to_login()
+        if self.config.error_rate and self.config.random.random() < self.config.error_rate:
+            self.delay()
+            return self.send(503, "Service Unavailable", 'text/plain', {'Retry-After': '0'})
+        if path == FINANCIAL_STATUS_PAGE.lower(): return self.token_page()
+        if path == CUSTOMER_FINANCIAL_STATUS_GET.lower(): return self.customers(query)
+        if path == GET_ACCOUNT_STATEMENT_API.lower(): return self.account_statement(query)
+        if path.startswith(ACCOUNT_STATEMENT_PAGE.lower() + '/'): return self.statement_page(path.rsplit('/', 1)[1])
+        if path == REPORT_GEN_POST.lower() and method == 'POST': return self.report(form)
+        if path == REPORT_VIEWER_BASE.lower(): return self.viewer(query)
+        if path == PDF_AXD_ENDPOINT.lower(): return self.pdf(query)
+        self.send(404, "Not Found", 'text/plain')
+
+    # --- نقاط النهاية ---
+    def login_page(self):
+        self.send(200, self.recorded('login_page') or
+                  f'<html><body><form><input name="__RequestVerificationToken" type="hidden" value="{TOKEN}" /></form></body></html>')
+
+    def login(self, form):
+        if not form.get('UserName') or not form.get('Password'): return self.send_json({'success': False})
+        sid = uuid.uuid4().hex
+        self.server.sessions[sid] = time.time()
+        body = json.dumps({'success': True}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', f'{SESSION_COOKIE}={sid}; Path=/; HttpOnly')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def token_page(self):
+        self.delay()
+        self.send(200, self.recorded('token_page') or
+                  f'<html><body><input name="__RequestVerificationToken" type="hidden" value="{TOKEN}" /></body></html>')
+
+    def customers(self, query):
+        self.delay()
+        page, size = int(query.get('page', ['1'])[0]), int(query.get('pageSize', ['500'])[0])
+        first = (page - 1) * size
+        ids = range(FIRST_CLIENT_ID + first, FIRST_CLIENT_ID + min(first + size, self.config.customers))
+        self.send_json({'total': self.config.customers, 'data': [
+            {'CustomerId': cid, 'CustomerName': f"وكالة {cid}", 'TotalBalance': f"{cid * 7.25:,.2f}"} for cid in ids]})
+
+    def account_statement(self, query):
+        self.delay()
+        cid = query.get('AgencyId', ['0'])[0]
+        start = parse_day(query.get('fromDate', [''])[0], date.min)
+        end = parse_day(query.get('toDate', [''])[0], date.max)
+        # رصيد جارٍ من أول حركة حتى يمكن فحص الافتتاحي/الختامي لكل فترة
+        rows = [{'TransactionId': t, 'Date': transaction_date(i).strftime(DATE_FORMAT), 'Amount': 10.0, 'Balance': 10.0 * (i + 1)}
+                for i, t in enumerate(client_transactions(cid, self.config.transactions)) if start <= transaction_date(i) <= end]
+        balance = int(cid) * 7.25 if cid.isdigit() else 0.0
+        self.send_json({'TotalBalance': f"{balance:,.2f}", 'data': rows})
+
+    def statement_page(self, cid):
+        self.delay()
+        recorded = self.recorded('statement_page')
+        if recorded: return self.send(200, recorded)
+        rows = ''.join(f'<tr><td><input name="Transactions" type="checkbox" value="{t}" checked="checked"></td></tr>'
+                       for t in client_transactions(cid, self.config.transactions))
+        self.send(200, f'<html><body><form><table>{rows}</table></form></body></html>')
+
+    def report(self, form):
+        if not form.get('__RequestVerificationToken'): return self.send(400, "Missing token", 'text/plain')
+        # توليد التقرير هو الجزء الأبطأ على الخادم الحقيقي
+        self.delay(self.config.report_latency)
+        rid = str(uuid.uuid4())
+        self.server.reports[rid] = control = uuid.uuid4().hex
+        self.server.control_ids.add(control)
+        self.send(200, self.recorded('report') or f'/Reports/Viewer.aspx?id={rid}', 'text/plain')
+
+    def viewer(self, query):
+        self.delay()
+        control = self.server.reports.get(query.get('id', [''])[0])
+        if not control: return self.send(404, "Report expired", 'text/plain')
+        recorded = self.recorded('viewer')
+        if recorded: return self.send(200, re.sub(rb'ControlID=[0-9a-fA-F]{32}', b'ControlID=' + control.encode(), recorded))
+        self.send(200, f'<html><body><iframe src="{PDF_AXD_ENDPOINT}?ControlID={control}&amp;OpType=Export"></iframe></body></html>')
+
+    def pdf(self, query):
+        self.delay()
+        if query.get('ControlID', [''])[0] not in self.server.control_ids: return self.send(404, "Unknown control", 'text/plain')
+        data, start, status = self.config.pdf, 0, 200
+        match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if match and (not if_range or if_range == self.config.pdf_etag):
+            start = int(match.group(1))
+            if start >= len(data): return self.send(416, headers={'Content-Range': f'bytes */{len(data)}'})
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(data) - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', self.config.pdf_etag)
+        if status == 206: self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        self.end_headers()
+        view = memoryview(data)
+        for pos in range(start, len(data), SEND_CHUNK):
+            chunk = view[pos:pos + SEND_CHUNK]
+            self.wfile.write(chunk)
+            if self.config.bandwidth: time.sleep(len(chunk) / self.config.bandwidth)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, ReplayHandler)
+        self.config = config
+        self.sessions = {}
+        self.reports = {}
+        self.control_ids = set()
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, path):
+        with self._lock: self.requests[path] = self.requests.get(path, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the booking site (synthetic or recorded responses).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800, help="0 picks a free port")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.01, help="+/- seconds of random latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--report-latency', type=float, default=0.2, help="extra seconds for ReportAccountStatement")
+    parser.add_argument('--pdf-kb', type=int, default=256)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=50, help="transactions per client")
+    parser.add_argument('--bandwidth', type=float, default=0, help="PDF bytes per second per connection (0 = unlimited)")
+    parser.add_argument('--session-ttl', type=float, default=0, help="seconds before a login expires (0 = never)")
+    parser.add_argument('--recordings', help="directory with recorded responses named after the stage")
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(argv)
+
+
+def config_from_args(args):
+    return ReplayConfig(args.latency, args.jitter, args.error_rate, args.report_latency, args.pdf_kb, args.customers,
+                        args.transactions, args.bandwidth, args.session_ttl, args.recordings, args.seed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = ReplayServer((args.host, args.port), config_from_args(args))
+    # السطر الأول يقرؤه bench_backend لمعرفة المنفذ
+    print(f"listening on {server.base_url}", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+اختبار ضغط لجلسة requests واحدة مشتركة بين عدة خيوط مقابل benchmarks/replay_server.py.
+
+كل خيط ينفذ المسار الكامل لعملاء مختلفين (الرصيد، صفحة الكشف، التقرير، العارض، PDF)
+على نفس الجلسة في نفس الوقت. الخادم يسجل ترويسات كل طلب، ثم يُتحقق أن كل طلب
+حمل ترويسات نقطة نهايته فقط (Referer و X-Requested-With و Content-Type من
+backend.ENDPOINTS) وأن session.headers لم تتغير بعد التشغيل.
+
+الاستخدام:
+    python benchmarks/stress_session.py --threads 16 --clients 200
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHECKED_HEADERS = ('Referer', 'X-Requested-With', 'Content-Type')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Many threads on one shared session: per-endpoint headers must not leak.")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--pdf-kb', type=int, default=32)
+    return parser.parse_args(argv)
+
+
+def endpoint_for(method, path, endpoints):
+    for name, ep in endpoints.items():
+        ep_path = ep.path.split('?', 1)[0]
+        prefix = ep_path.split('{', 1)[0]
+        if ep.method == method and (path == ep_path if prefix == ep_path else path.startswith(prefix)): return name
+    return None
+
+
+def check(seen, endpoints):
+    problems, counts = [], {}
+    for method, path, headers in seen:
+        name = endpoint_for(method, path, endpoints)
+        if name is None: continue
+        counts[name] = counts.get(name, 0) + 1
+        expected = {h: endpoints[name].headers.get(h) for h in CHECKED_HEADERS}
+        if headers != expected: problems.append(f"{name}: sent {headers}, expected {expected}")
+    return problems, counts
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # backend يقرأ BOOKING_BASE_URL عند الاستيراد (replay_server يستورده أيضاً)
+    port = free_port()
+    os.environ['BOOKING_BASE_URL'] = f"http://127.0.0.1:{port}"
+    import backend
+    from replay_server import ReplayServer, ReplayConfig, ReplayHandler
+
+    class RecordingHandler(ReplayHandler):
+
+        def route(self, method):
+            with self.server._lock:
+                self.server.seen.append((method, self.path.split('?', 1)[0], {h: self.headers.get(h) for h in CHECKED_HEADERS}))
+            super().route(method)
+
+    server = ReplayServer(('127.0.0.1', port), ReplayConfig(latency=args.latency, jitter=0, report_latency=args.latency,
+                                                         pdf_kb=args.pdf_kb, customers=args.clients + 10, seed=1))
+    server.RequestHandlerClass, server.seen = RecordingHandler, []
+    server.start()
+
+    workdir = tempfile.mkdtemp(prefix='stress_session_')
+    try:
+        session = backend.create_session_with_retry()
+        if not backend.perform_full_login(session, 'stress', 'stress'):
+            print("login against the replay server failed"); return 1
+        token = backend.get_report_token(session)
+        before = dict(session.headers)
+
+        def client(i):
+            cid = str(1001 + i)
+            backend.get_customer_balance(session, cid)
+            ok, msg = backend.download_single_pdf(session, cid, f"Client {cid}", workdir, '01/01/2025', '', token)
+            return ok or msg
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = list(pool.map(client, range(args.clients)))
+        wall = time.perf_counter() - start
+        errors = [r for r in results if r is not True]
+        problems, counts = check(server.seen, backend.ENDPOINTS)
+        if dict(session.headers) != before: problems.append(f"session.headers changed: {before} -> {dict(session.headers)}")
+
+        print(f"{args.clients} clients on {args.threads} threads, one session: {wall:.2f}s, {args.clients / wall:.1f} clients/s")
+        print("  requests: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+        print(f"  failed clients: {len(errors)}" + (f" (first: {errors[0]})" if errors else ""))
+        print(f"  header mismatches: {len(problems)}")
+        for line in problems[:10]: print("   ", line)
+        return 1 if errors or problems else 0
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
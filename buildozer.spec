@@ -3,9 +3,10 @@ title = BookingTool
 package.name = bookingtool
 package.domain = org.jood
 source.dir = .
-source.include_exts = py,png,jpg,kv,atlas,ttf,json,pkl
+source.include_exts = py,png,jpg,kv,atlas,ttf,json
+source.exclude_patterns = session_cookies.json,session_cookies.json.tmp,customers_cache.json,customers.db*
 version = 0.1
-requirements = python3,kivy==2.3.0,requests,urllib3,beautifulsoup4,openpyxl,arabic-reshaper,python-bidi,openssl
+requirements = python3,kivy==2.3.0,sqlite3,requests,urllib3,openpyxl,arabic-reshaper,python-bidi,openssl
 orientation = portrait
 fullscreen = 0
 android.permissions = INTERNET,WRITE_EXTERNAL_STORAGE,READ_EXTERNAL_STORAGE,ACCESS_NETWORK_STATE
@@ -0,0 +1,155 @@
+"""
+تشغيل الكشوفات من سطر الأوامر بدون Kivy (مناسب لـ cron على خادم بدون شاشة).
+
+أمثلة:
+    python cli.py --clients 101,102 --output ./out --concurrency 4
+    python cli.py --clients-file ids.txt --balances-only --json
+    python cli.py --clients-file ids.txt --concurrency 2 --download-workers 4
+    python cli.py --clients-file ids.txt --profile --metrics run.prom
+    python cli.py --clients 4711 --from 01/01/2021 --shard quarter
+    python cli.py --clients-file ids.txt --compact --zip --merge
+
+بيانات الدخول من BOOKING_USERNAME / BOOKING_PASSWORD أو --username / --password.
+مع --json يُطبع سطر JSON لكل حدث (start / progress / done / finished).
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+from backend import (
+    USERNAME, PASSWORD, DEFAULT_CONCURRENCY, MAX_CONCURRENCY, SessionManager, get_all_client_names,
+    parse_client_ids, run_batch,
+)
+from summary import SummaryWriter
+from metrics import RunMetrics
+from postprocess import PostProcessor, MERGED_FILENAME, POSTPROCESS_WORKERS
+
+EXIT_OK, EXIT_FAILURES, EXIT_LOGIN = 0, 1, 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download account statements and balances without the UI.")
+    parser.add_argument('--clients', default='', help="client IDs separated by commas or spaces")
+    parser.add_argument('--clients-file', help="file with client IDs (one per line or comma separated), '-' for stdin")
+    parser.add_argument('--from', dest='from_date', default='01/01/2025')
+    parser.add_argument('--to', dest='to_date', default='')
+    parser.add_argument('--output', default=os.path.expanduser('~/Downloads'))
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f"parallel clients (max {MAX_CONCURRENCY})")
+    parser.add_argument('--download-workers', type=int, default=0,
+                        help="pipeline mode: --concurrency workers generate reports, this many download the PDFs (0 = off)")
+    parser.add_argument('--shard', choices=['month', 'quarter', 'year'],
+                        help="split each statement into period reports generated in parallel and merged (large agencies)")
+    parser.add_argument('--balances-only', action='store_true', help="only fetch balances, no PDFs")
+    parser.add_argument('--no-skip-unchanged', action='store_true', help="regenerate statements even if unchanged")
+    parser.add_argument('--summary', default='Summary.xlsx', help="summary file name inside --output, a .csv beside it is written as clients finish ('' to disable)")
+    parser.add_argument('--compact', action='store_true', help="losslessly recompress each PDF as it finishes (pikepdf, else pypdf)")
+    parser.add_argument('--zip', nargs='?', const='', help="write a ZIP of the run's PDFs and manifest as they finish (default name inside --output)")
+    parser.add_argument('--merge', nargs='?', const=MERGED_FILENAME, help="also write one PDF of all statements with a bookmark per client")
+    parser.add_argument('--post-workers', type=int, default=POSTPROCESS_WORKERS, help="processes for the post-processing stage")
+    parser.add_argument('--username', default=USERNAME)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--json', action='store_true', help="JSON lines progress on stdout")
+    parser.add_argument('--profile', action='store_true', help="print per-stage timings (p50/p95) and the slowest clients at the end")
+    parser.add_argument('--metrics', help="write the timing report to this file (JSON, or Prometheus text for .prom/.txt)")
+    parser.add_argument('--log-requests', action='store_true', help="log every request as a JSON line on stderr")
+    return parser.parse_args(argv)
+
+
+def read_client_ids(args):
+    text = args.clients
+    if args.clients_file:
+        with (sys.stdin if args.clients_file == '-' else open(args.clients_file, 'r', encoding='utf-8')) as f:
+            text += ' ' + f.read()
+    return parse_client_ids(text)
+
+
+class Reporter:
+    """طباعة التقدم كنص مقروء أو كسطور JSON"""
+
+    def __init__(self, as_json):
+        self.as_json = as_json
+        self._last_pct = {}
+
+    def emit(self, event, text, **fields):
+        if self.as_json:
+            print(json.dumps(dict(event=event, time=round(time.time(), 3), **fields), ensure_ascii=False), flush=True)
+        elif text:
+            print(text, file=sys.stderr, flush=True)
+
+    def on_start(self, idx, total, cid, name):
+        self.emit('start', f"[{idx}/{total}] {name}", index=idx, total=total, id=cid, name=name)
+
+    def on_progress(self, idx, total, row, cur, tot):
+        # سطر لكل 10% فقط حتى لا يغرق المخرج بأجزاء التنزيل
+        pct = int(cur * 100 / tot) // 10 * 10 if tot else 0
+        if self._last_pct.get(row['id']) == pct: return
+        self._last_pct[row['id']] = pct
+        self.emit('progress', None, index=idx, total=total, id=row['id'], bytes=cur, size=tot, percent=pct)
+
+    def on_done(self, idx, total, row):
+        status = 'OK' if row['ok'] else 'ERR'
+        self.emit('done', f"[{idx}/{total}] {row['name']} - {row['balance']} - {status} {row['msg']}".rstrip(),
+                  index=idx, total=total, id=row['id'], name=row['name'], balance=row['balance'],
+                  balance_value=row['balance_float'], ok=row['ok'], message=row['msg'])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    reporter = Reporter(args.json)
+    client_ids = read_client_ids(args)
+    if not client_ids:
+        reporter.emit('error', "no client IDs given", message="no client IDs given")
+        return EXIT_FAILURES
+
+    if args.log_requests:
+        logging.basicConfig(stream=sys.stderr, format='%(message)s')
+        logging.getLogger('booking.metrics').setLevel(logging.DEBUG)
+    started = time.time()
+    metrics = RunMetrics()
+    manager = SessionManager(args.username, args.password)
+    metrics.attach(manager.session)
+    if not manager.start():
+        reporter.emit('error', "login failed", message="login failed")
+        return EXIT_LOGIN
+
+    customers = get_all_client_names(manager.session)
+    summary_path = os.path.join(args.output, args.summary) if args.summary else None
+    summary = SummaryWriter(summary_path) if summary_path else None
+    post = None
+    if args.compact or args.zip is not None or args.merge:
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        zip_path = (args.zip or os.path.join(args.output, f"Statements_{stamp}.zip")) if args.zip is not None else None
+        post = PostProcessor(args.output, compact=args.compact, zip_path=zip_path,
+                             merge_path=os.path.join(args.output, args.merge) if args.merge else None,
+                             manifest_path=os.path.join(args.output, f"Statements_{stamp}_manifest.json"),
+                             workers=args.post_workers)
+    post_result = None
+    try:
+        results = run_batch(manager.session, client_ids, customers, args.output, args.from_date, args.to_date, manager.report_token,
+                            args.concurrency, reporter.on_start, reporter.on_progress, reporter.on_done,
+                            skip_unchanged=not args.no_skip_unchanged, balances_only=args.balances_only,
+                            session_manager=manager, download_workers=args.download_workers, summary=summary,
+                            metrics=metrics, shard_period=args.shard, postprocess=post)
+    finally:
+        if summary: summary.close()
+        if post: post_result = post.close()
+
+    total_sum = sum(r['balance_float'] for r in results if r['ok'])
+    failed = sum(1 for r in results if not r['ok'])
+    if args.metrics: metrics.export(args.metrics)
+    if args.profile: print(metrics.report(), file=sys.stderr, flush=True)
+    if post_result:
+        reporter.emit('postprocess', f"Post-processing: {post_result['files']} files, {post_result['original_size']:,} -> "
+                      f"{post_result['size']:,} bytes" + "".join(f", {k}: {post_result[k]}" for k in ('zip', 'merged', 'merge_error') if k in post_result),
+                      **post_result)
+    reporter.emit('finished', f"Total: SAR {total_sum:,.2f} ({len(results) - failed} ok, {failed} failed)",
+                  total_sum=round(total_sum, 2), processed=len(results), failed=failed,
+                  summary=summary_path, metrics=args.metrics, seconds=round(time.time() - started, 2))
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+دليل العملاء المحلي على SQLite مع فهارس للبحث السريع:
+- بالرقم (مطابقة كاملة أو بادئة)
+- ببادئة الاسم العربي أو اللاتيني بعد التطبيع
+- بحث تقريبي عبر فهرس الثلاثيات (trigrams)
+
+المخزن يتصرف كقاموس للقراءة (Mapping) لذلك يعمل مكان قاموس العملاء القديم
+مع get_client_name_from_dict ويقرأ فقط الصفوف المطلوبة.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import difflib
+from threading import Lock
+from collections.abc import Mapping
+
+CUSTOMERS_DB_FILE = "customers.db"
+SEARCH_LIMIT = 8
+FUZZY_CANDIDATES = 50
+FUZZY_MIN_SCORE = 0.5
+
+_TASHKEEL = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه'})
+_SPACES = re.compile(r'\s+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS customers_norm ON customers(norm);
+CREATE TABLE IF NOT EXISTS customer_trigrams (
+    tri TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (tri, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def normalize_name(text):
+    """توحيد أشكال الألف والياء والتاء المربوطة وحذف التشكيل، وتصغير الحروف اللاتينية"""
+    text = _TASHKEEL.sub('', str(text or '')).translate(_ARABIC_FOLD).lower()
+    return _SPACES.sub(' ', text).strip()
+
+
+def trigrams(norm):
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CustomerStore(Mapping):
+
+    def __init__(self, path=CUSTOMERS_DB_FILE):
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    # --- Mapping (id -> name) ---
+
+    def __getitem__(self, cid):
+        name = self.get_name(cid)
+        if name is None: raise KeyError(cid)
+        return name
+
+    def __iter__(self):
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT id FROM customers")]
+        return iter(ids)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM customers").fetchone()[0]
+
+    def __contains__(self, cid):
+        return self.get_name(cid) is not None
+
+    def __bool__(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM customers LIMIT 1").fetchone() is not None
+
+    def get_name(self, cid):
+        with self._lock:
+            row = self._conn.execute("SELECT name FROM customers WHERE id = ?", (str(cid),)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, ids):
+        ids = [str(i) for i in ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ','.join('?' * len(chunk))
+                found.update(self._conn.execute(f"SELECT id, name FROM customers WHERE id IN ({marks})", chunk))
+        return found
+
+    # --- Sync ---
+
+    def sync(self, customers, complete=True):
+        """
+        دمج الدليل القادم من الخادم: تُكتب فقط الصفوف الجديدة أو التي تغير اسمها،
+        وتُحذف الصفوف المختفية فقط إذا كانت القائمة كاملة. يعيد عدد الصفوف المتغيرة.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            existing = dict(self._conn.execute("SELECT id, name FROM customers"))
+            changed = [(cid, name) for cid, name in customers.items() if existing.get(cid) != name]
+            removed = [cid for cid in existing if cid not in customers] if complete else []
+            for cid in removed + [cid for cid, _ in changed]:
+                self._conn.execute("DELETE FROM customer_trigrams WHERE id = ?", (cid,))
+            self._conn.executemany("DELETE FROM customers WHERE id = ?", [(cid,) for cid in removed])
+            for cid, name in changed:
+                norm = normalize_name(name)
+                self._conn.execute("INSERT OR REPLACE INTO customers (id, name, norm, updated) VALUES (?, ?, ?, ?)", (cid, name, norm, now))
+                self._conn.executemany("INSERT OR IGNORE INTO customer_trigrams (tri, id) VALUES (?, ?)", [(t, cid) for t in trigrams(norm)])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_sync', ?)", (str(now),))
+        return len(changed) + len(removed)
+
+    def last_sync(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_sync'").fetchone()
+        return float(row[0]) if row else 0.0
+
+    def age_hours(self):
+        last = self.last_sync()
+        return (time.time() - last) / 3600 if last else float('inf')
+
+    def import_json_cache(self, filename):
+        """ترحيل ملف customers_cache.json القديم مرة واحدة"""
+        if not os.path.exists(filename): return 0
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                cache_data = json.load(f)
+        except (OSError, ValueError): return 0
+        count = self.sync(cache_data.get('customers', {}), complete=False)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_sync', ?)", (str(cache_data.get('timestamp', 0)),))
+        return count
+
+    # --- Search ---
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """اقتراحات [(id, name)]: بادئة الرقم، ثم بادئة الاسم، ثم البحث التقريبي"""
+        query = str(query or '').strip()
+        if not query: return []
+        if query.isdigit():
+            with self._lock:
+                return self._conn.execute(
+                    "SELECT id, name FROM customers WHERE id >= ? AND id < ? ORDER BY length(id), id LIMIT ?",
+                    (query, query + '\uffff', limit)).fetchall()
+        norm = normalize_name(query)
+        with self._lock:
+            results = self._conn.execute(
+                "SELECT id, name FROM customers WHERE norm >= ? AND norm < ? ORDER BY norm LIMIT ?",
+                (norm, norm + '\uffff', limit)).fetchall()
+        if len(results) < limit:
+            seen = {cid for cid, _ in results}
+            results += [r for r in self.fuzzy_search(norm, limit) if r[0] not in seen][:limit - len(results)]
+        return results
+
+    def fuzzy_search(self, query, limit=SEARCH_LIMIT):
+        """ترتيب المرشحين حسب عدد الثلاثيات المشتركة ثم نسبة التشابه"""
+        norm = normalize_name(query)
+        grams = sorted(trigrams(norm))
+        if not grams: return []
+        marks = ','.join('?' * len(grams))
+        with self._lock:
+            candidates = self._conn.execute(
+                f"SELECT c.id, c.name, c.norm FROM customer_trigrams t JOIN customers c ON c.id = t.id "
+                f"WHERE t.tri IN ({marks}) GROUP BY t.id ORDER BY COUNT(*) DESC LIMIT ?",
+                grams + [FUZZY_CANDIDATES]).fetchall()
+
+        def score(row):
+            if norm in row[2]: return 2.0
+            return difflib.SequenceMatcher(None, norm, row[2][:len(norm) + 10]).ratio()
+
+        scored = sorted(((score(row), row) for row in candidates), key=lambda x: x[0], reverse=True)
+        return [(cid, name) for sc, (cid, name, _) in scored[:limit] if sc >= FUZZY_MIN_SCORE]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,356 @@
+"""
+خدمة دائمة بجلسة مسجلة الدخول ودليل عملاء في الذاكرة، مع واجهة HTTP/JSON محلية.
+
+كل تشغيل للتطبيق أو لسكربت يدفع تكلفة البداية كاملة (تسجيل الدخول، دليل العملاء،
+رمز التقرير). الخدمة تدفعها مرة واحدة وتشاركها بين كل الأدوات:
+
+    GET  /health                      حالة الجلسة والدليل والمهام
+    GET  /customers?q=نخيل            بحث في دليل العملاء
+    GET  /balance/{id}[?from=..]      رصيد عميل (ذاكرة مؤقتة لمدة BALANCE_TTL)
+    POST /statements                  {"clients": [..], "from": "..", "to": "..", "output": "..",  (داخل --output-root)
+                                       "concurrency": 2, "balances_only": false, "shard": null} -> {"job": id}
+    GET  /jobs/{id}                   التقدم والنتائج
+    POST /jobs/{id}/cancel
+
+الطلبات المتطابقة المتزامنة تُنفذ مرة واحدة (نفس الرصيد، أو نفس المهمة ما دامت تعمل).
+مهام الكشوفات على نفس مجلد الحفظ تعمل واحدة بعد الأخرى (الحالة queued أثناء الانتظار)،
+لأن سجل التخطي (StatementManifest) وسجل الاستئناف (JobJournal) ملف واحد لكل مجلد.
+
+الواجهة تحمل تسجيل الدخول، فكل طلب يحتاج Authorization: Bearer <token>. الرمز من
+BOOKING_DAEMON_TOKEN، وإلا يُولّد مرة واحدة في ملف بصلاحية 0600 (--token-file).
+الاستماع على 127.0.0.1، وتُرفض الطلبات بـ Host غير محلي أو Origin من موقع آخر (صفحات
+الويب و DNS rebinding)، و POST بغير application/json. مجلد الحفظ دائماً داخل --output-root.
+
+    python daemon.py --port 8765
+"""
+import os
+import sys
+import json
+import time
+import hmac
+import uuid
+import hashlib
+import secrets
+import argparse
+from threading import Thread, Lock, Event
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from backend import (
+    USERNAME, PASSWORD, DEFAULT_CONCURRENCY, SessionManager, get_all_client_names, search_clients,
+    resolve_client_balance, get_client_name_from_dict, parse_client_ids, run_batch,
+)
+from ratelimit import AdaptiveRateLimiter
+from summary import SummaryWriter
+
+DEFAULT_PORT = 8765
+BALANCE_TTL = 60
+MAX_FINISHED_JOBS = 100
+MAX_BODY = 1024 * 1024
+DAEMON_TOKEN = os.getenv('BOOKING_DAEMON_TOKEN', '')
+TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.booking_daemon_token')
+OUTPUT_ROOT = os.path.join(os.path.expanduser('~'), 'Downloads')
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '[::1]')
+
+
+def load_token(path=TOKEN_FILE):
+    """BOOKING_DAEMON_TOKEN، أو الرمز المحفوظ، أو رمز جديد في ملف لا يقرؤه غير المستخدم"""
+    if DAEMON_TOKEN: return DAEMON_TOKEN
+    try:
+        with open(path, 'r', encoding='utf-8') as f: token = f.read().strip()
+        if token: return token
+    except FileNotFoundError: pass
+    token = secrets.token_urlsafe(32)
+    fd = os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f: f.write(token)
+    os.replace(path + '.tmp', path)
+    return token
+
+
+def output_under(root, output):
+    """مسار الحفظ المطلوب (نسبياً إلى root) بشرط ألا يخرج منه"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, os.path.expanduser(output or '')))
+    if os.path.commonpath([root, path]) != root: raise ValueError(f"output must be inside {root}")
+    return path
+
+
+class SingleFlight:
+    """طلبات متزامنة بنفس المفتاح تنتظر نتيجة تنفيذ واحد"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader: call = self._calls[key] = {'done': Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+        else:
+            try: call['result'] = fn()
+            except Exception as e: call['error'] = e
+            finally:
+                with self._lock: self._calls.pop(key, None)
+                call['done'].set()
+        if call['error'] is not None: raise call['error']
+        return call['result']
+
+
+class TTLCache:
+
+    def __init__(self, ttl):
+        self.ttl, self._data, self._lock = ttl, {}, Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and time.monotonic() - hit[0] < self.ttl: return hit[1]
+            self._data.pop(key, None)
+            return None
+
+    def set(self, key, value):
+        with self._lock: self._data[key] = (time.monotonic(), value)
+
+
+class StatementDaemon:
+
+    def __init__(self, username, password, balance_ttl=BALANCE_TTL, output_root=OUTPUT_ROOT):
+        self.manager = SessionManager(username, password)
+        self.output_root = output_root
+        self.customers = {}
+        self.limiter = AdaptiveRateLimiter()  # مشترك بين كل المهام حتى لا تتضاعف سرعة الطلبات على الخادم
+        self.balances = TTLCache(balance_ttl)
+        self.flights = SingleFlight()
+        self.jobs = {}
+        self._active = {}  # مفتاح الطلب -> رقم المهمة الجارية
+        self._directories = {}  # مجلد الحفظ -> قفل المهمة التي تكتب فيه
+        self._lock = Lock()
+        self.started = time.time()
+
+    def start(self):
+        if not self.manager.start(): return False
+        self.customers = get_all_client_names(self.manager.session)
+        return True
+
+    def with_session(self, fn):
+        sess = self.manager.acquire()
+        result = fn(sess)
+        if self.manager.is_expired(sess) and self.manager.refresh():
+            result = fn(self.manager.acquire())
+        return result
+
+    def balance(self, client_id, from_date):
+        key = (str(client_id), from_date)
+        cached = self.balances.get(key)
+        if cached: return dict(cached, cached=True)
+
+        def fetch():
+            raw, value = self.with_session(lambda sess: resolve_client_balance(sess, client_id, from_date))
+            row = {'id': str(client_id), 'name': get_client_name_from_dict(client_id, self.customers),
+                   'balance': raw, 'balance_value': value, 'ok': raw != "N/A"}
+            if row['ok']: self.balances.set(key, row)
+            return row
+        return dict(self.flights.do(('balance',) + key, fetch), cached=False)
+
+    def submit(self, request):
+        clients = parse_client_ids(' '.join(map(str, request.get('clients') or [])))
+        if not clients: raise ValueError("no client IDs given")
+        params = {'clients': clients, 'from': request.get('from') or '01/01/2025', 'to': request.get('to') or '',
+                  'output': output_under(self.output_root, request.get('output')),
+                  'concurrency': int(request.get('concurrency') or DEFAULT_CONCURRENCY),
+                  'balances_only': bool(request.get('balances_only')), 'shard': request.get('shard') or None}
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            running = self._active.get(key)
+            if running: return self.jobs[running], False
+            job = {'id': uuid.uuid4().hex[:12], 'status': 'queued', 'params': params, 'total': len(clients), 'done': 0,
+                   'failed': 0, 'total_sum': 0.0, 'current': None, 'results': [], 'summary': None,
+                   'created': time.time(), 'finished': None, 'error': None, 'stop': Event()}
+            self.jobs[job['id']] = job
+            self._active[key] = job['id']
+            self._evict_finished()
+        Thread(target=self._run_job, args=(job, key), daemon=True).start()
+        return job, True
+
+    def _evict_finished(self):
+        finished = sorted((j for j in self.jobs.values() if j['finished']), key=lambda j: j['finished'])
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]: self.jobs.pop(job['id'], None)
+
+    def _directory_lock(self, path):
+        with self._lock: return self._directories.setdefault(os.path.realpath(path), Lock())
+
+    def _run_job(self, job, key):
+        p = job['params']
+        if p['balances_only']: return self._run_batch_job(job, key)
+        with self._directory_lock(p['output']):
+            if job['stop'].is_set():
+                job['status'], job['finished'] = 'cancelled', time.time()
+                with self._lock: self._active.pop(key, None)
+                return
+            self._run_batch_job(job, key)
+
+    def _run_batch_job(self, job, key):
+        p = job['params']
+        job['status'] = 'running'
+
+        def on_start(idx, total, cid, name): job['current'] = {'id': cid, 'name': name, 'bytes': 0, 'size': 0}
+
+        def on_progress(idx, total, row, cur, tot): job['current'] = {'id': row['id'], 'name': row['name'], 'bytes': cur, 'size': tot}
+
+        def on_done(idx, total, row):
+            with self._lock:
+                job['done'] += 1
+                if not row['ok']: job['failed'] += 1
+                else: job['total_sum'] += row['balance_float']
+                job['results'].append(row)
+            if row['ok'] and row.get('balance') not in (None, "N/A"):
+                self.balances.set((str(row['id']), p['from']), {'id': str(row['id']), 'name': row['name'], 'balance': row['balance'],
+                                                                 'balance_value': row['balance_float'], 'ok': True})
+        try:
+            summary_path = os.path.join(p['output'], f"Summary_{job['id']}.xlsx")
+            with SummaryWriter(summary_path) as summary:
+                run_batch(self.manager.session, p['clients'], self.customers, p['output'], p['from'], p['to'],
+                          self.manager.report_token, p['concurrency'], on_start, on_progress, on_done, job['stop'],
+                          balances_only=p['balances_only'], session_manager=self.manager, rate_limiter=self.limiter,
+                          summary=summary, shard_period=p['shard'])
+            job['summary'] = summary_path
+            job['status'] = 'cancelled' if job['stop'].is_set() else 'finished'
+        except Exception as e:
+            job['status'], job['error'] = 'failed', str(e)
+        finally:
+            job['finished'], job['current'] = time.time(), None
+            with self._lock: self._active.pop(key, None)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job: job['stop'].set()
+        return job
+
+    @staticmethod
+    def job_view(job, results=True):
+        view = {k: v for k, v in job.items() if k not in ('stop', 'results')}
+        view['total_sum'] = round(job['total_sum'], 2)
+        if results:
+            view['results'] = [{'id': r['id'], 'name': r['name'], 'balance': r['balance'], 'balance_value': r['balance_float'],
+                                'ok': r['ok'], 'message': (r.get('msg') or '').strip(), 'file': r.get('file')} for r in list(job['results'])]
+        return view
+
+    def health(self):
+        return {'ok': True, 'uptime': round(time.time() - self.started, 1), 'customers': len(self.customers),
+                'session_generation': self.manager.generation, 'rate': round(self.limiter.rate, 2),
+                'jobs': {s: sum(1 for j in self.jobs.values() if j['status'] == s) for s in ('queued', 'running', 'finished', 'cancelled', 'failed')}}
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'StatementDaemon/1.0'
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose: sys.stderr.write("%s %s\n" % (self.address_string(), fmt % args))
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        return hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {self.server.token}")
+
+    def local_request(self):
+        """Host محلي (ضد DNS rebinding) و Origin إن وُجد من نفس العنوان (ضد صفحات الويب)"""
+        host = self.headers.get('Host', '')
+        if host.rsplit(':', 1)[0] not in self.server.hosts: return False
+        origin = self.headers.get('Origin')
+        return origin is None or origin == f"http://{host}"
+
+    def read_json(self):
+        if self.headers.get('Content-Type', '').split(';', 1)[0].strip().lower() != 'application/json':
+            raise ValueError("Content-Type must be application/json")
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY: raise ValueError("request body too large")
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def route(self, method):
+        if not self.local_request(): return self.send_json(403, {'error': 'forbidden'})
+        if not self.authorized(): return self.send_json(401, {'error': 'unauthorized'})
+        url = urlsplit(self.path)
+        parts, query = [p for p in url.path.split('/') if p], parse_qs(url.query)
+        try:
+            if method == 'GET' and parts == ['health']: return self.send_json(200, self.service.health())
+            if method == 'GET' and parts == ['customers']:
+                return self.send_json(200, [{'id': cid, 'name': name} for cid, name in search_clients(query.get('q', [''])[0])])
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'balance':
+                row = self.service.balance(parts[1], query.get('from', ['01/01/2025'])[0])
+                return self.send_json(200 if row['ok'] else 502, row)
+            if method == 'POST' and parts == ['statements']:
+                job, created = self.service.submit(self.read_json())
+                return self.send_json(202 if created else 200, {'job': job['id'], 'created': created, 'status': job['status']})
+            if method == 'GET' and parts == ['jobs']:
+                return self.send_json(200, [self.service.job_view(j, results=False) for j in list(self.service.jobs.values())])
+            if method == 'GET' and len(parts) == 2 and parts[0] == 'jobs':
+                job = self.service.jobs.get(parts[1])
+                return self.send_json(200, self.service.job_view(job)) if job else self.send_json(404, {'error': 'unknown job'})
+            if method == 'POST' and len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+                job = self.service.cancel(parts[1])
+                return self.send_json(200, {'job': job['id'], 'status': 'cancelling'}) if job else self.send_json(404, {'error': 'unknown job'})
+            self.send_json(404, {'error': 'not found'})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, token, verbose=False):
+        super().__init__(address, DaemonHandler)
+        self.service, self.token, self.verbose = service, token, verbose
+        self.hosts = LOCAL_HOSTS + (address[0],)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a warm session and serve balances/statements over a local HTTP API.")
+    parser.add_argument('--host', default='127.0.0.1', help="listen address (keep it local: the API has your login)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--username', default=USERNAME)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--token-file', default=TOKEN_FILE, help="where the API token is kept (created 0600 if missing)")
+    parser.add_argument('--output-root', default=OUTPUT_ROOT, help="statement jobs may only write inside this directory")
+    parser.add_argument('--balance-ttl', type=float, default=BALANCE_TTL, help="seconds a fetched balance is served from memory")
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    daemon = StatementDaemon(args.username, args.password, args.balance_ttl, args.output_root)
+    if not daemon.start():
+        print("login failed", file=sys.stderr)
+        return 2
+    server = DaemonServer((args.host, args.port), daemon, load_token(args.token_file), verbose=args.verbose)
+    print(f"listening on http://{args.host}:{server.server_address[1]} ({len(daemon.customers)} customers), "
+          f"token in {'BOOKING_DAEMON_TOKEN' if DAEMON_TOKEN else args.token_file}", file=sys.stderr, flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
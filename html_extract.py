@@ -0,0 +1,124 @@
+"""
+استخراج سريع لحقول <input> من صفحات الموقع بدون بناء شجرة HTML كاملة.
+
+بدلاً من BeautifulSoup مع html.parser (Python خالص) نمسح وسوم input فقط
+بتعبير منتظم مُجمّع مسبقاً، ونتوقف فور العثور على الحقل المطلوب.
+InputScanner يعمل تدريجياً على أجزاء الاستجابة أثناء وصولها فلا نحتاج
+لتحميل الصفحة كاملة كنص واحد (صفحات كشف الحساب قد تبلغ عدة ميغابايت).
+الحقول داخل <!-- --> و <script> و <style> ليست حقولاً في الصفحة وتُتخطى كما في
+BeautifulSoup، حتى إذا انقسم التعليق أو السكربت بين جزأين.
+"""
+import re
+from html import unescape
+
+# الوسم قد يحتوي على '>' داخل قيمة بين علامتي تنصيص
+_TAG_ATTRS = r'''((?:[^>"']|"[^"]*"|'[^']*')*)'''
+# بداية تعليق، أو وسم script/style (مجموعة 1)، أو وسم input (مجموعة 3)
+_TOKEN = re.compile(r'<!--|<(script|style)\b' + _TAG_ATTRS + r'>|<input\b' + _TAG_ATTRS + r'>', re.IGNORECASE)
+_CLOSE = {'--': re.compile(r'-->'), 'script': re.compile(r'</script\s*>', re.IGNORECASE),
+          'style': re.compile(r'</style\s*>', re.IGNORECASE)}
+_PENDING = re.compile(r'<!--|<(?:script|style|input)\b', re.IGNORECASE)
+_MAX_TAIL = 64 * 1024
+_CLOSE_TAIL = 16  # يكفي لـ '</script >' مقطوعاً بين جزأين
+_ATTR = re.compile(r'''([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?''')
+
+
+def parse_attrs(attr_text):
+    attrs = {}
+    for name, dq, sq, bare in _ATTR.findall(attr_text):
+        name = name.lower()
+        if name not in attrs: attrs[name] = unescape(dq or sq or bare)
+    return attrs
+
+
+def _input_attrs(text, state):
+    """
+    نصوص خصائص وسوم input خارج التعليقات و script/style.
+    state = [pos, close]: موضع البداية والنهاية المنتظرة إذا بدأ النص داخل تعليق أو سكربت؛
+    يُحدّث أثناء المسح ليكمل الجزء التالي من حيث توقف.
+    """
+    pos, close = state
+    while True:
+        if close:
+            match = close.search(text, pos)
+            if not match:
+                state[:] = [pos, close]
+                return
+            pos, close = match.end(), None
+        match = _TOKEN.search(text, pos)
+        if not match:
+            state[:] = [pos, None]
+            return
+        pos = match.end()
+        if match.group(3) is None: close = _CLOSE[(match.group(1) or '--').lower()]
+        else:
+            state[:] = [pos, None]
+            yield match.group(3)
+
+
+def iter_input_tags(text):
+    for attr_text in _input_attrs(text or '', [0, None]):
+        yield parse_attrs(attr_text)
+
+
+def _matches(attrs, name, input_type):
+    if attrs.get('name') != name: return False
+    return input_type is None or attrs.get('type', '').lower() == input_type
+
+
+def find_input_value(text, name, input_type=None):
+    """قيمة أول input بهذا الاسم (مثل __RequestVerificationToken) أو None"""
+    for attrs in iter_input_tags(text):
+        if _matches(attrs, name, input_type): return attrs.get('value')
+    return None
+
+
+def collect_input_values(text, name, input_type=None):
+    """كل القيم غير الفارغة لحقول input بهذا الاسم والنوع، بترتيب ظهورها"""
+    return [a['value'] for a in iter_input_tags(text) if _matches(a, name, input_type) and a.get('value')]
+
+
+class InputScanner:
+    """
+    ماسح تدريجي: feed() لكل جزء نصي من الاستجابة، ويعيد True عند الاكتفاء
+    (أول قيمة إذا first_only). الجزء الأخير غير المكتمل من الوسم يُحتفظ به للجزء التالي.
+    """
+
+    def __init__(self, name, input_type=None, first_only=False):
+        self.name, self.input_type, self.first_only = name, input_type, first_only
+        self.values = []
+        self._tail = ''
+        self._close = None  # نهاية التعليق أو السكربت الذي انتهى الجزء السابق داخله
+
+    def feed(self, chunk):
+        text = self._tail + chunk
+        state = [0, self._close]
+        for attr_text in _input_attrs(text, state):
+            # تصفية سريعة قبل تحليل الخصائص
+            if self.name not in attr_text: continue
+            attrs = parse_attrs(attr_text)
+            if _matches(attrs, self.name, self.input_type) and attrs.get('value'):
+                self.values.append(attrs['value'])
+                if self.first_only: return True
+        end, self._close = state
+        if self._close:
+            # داخل تعليق أو سكربت: يكفي آخر بضعة أحرف لالتقاط نهايته المقطوعة
+            self._tail = text[max(end, len(text) - _CLOSE_TAIL):]
+            return False
+        # نحتفظ من بداية أول وسم غير مكتمل، وإلا من آخر '<' (قد يكون بداية وسم مقطوع)
+        pending = _PENDING.search(text, end)
+        start = pending.start() if pending else text.rfind('<', end)
+        self._tail = text[start:][-_MAX_TAIL:] if start != -1 else ''
+        return False
+
+    @property
+    def value(self):
+        return self.values[0] if self.values else None
+
+
+def scan_chunks(chunks, name, input_type=None, first_only=False):
+    """تشغيل InputScanner على مولّد أجزاء نصية مع التوقف المبكر"""
+    scanner = InputScanner(name, input_type, first_only)
+    for chunk in chunks:
+        if chunk and scanner.feed(chunk): break
+    return scanner.values
@@ -0,0 +1,107 @@
+"""
+سجل دائم (JSONL يُضاف إليه فقط) لحالة كل عميل في دفعة الكشوفات، بجانب مجلد الحفظ.
+
+عند إيقاف الدفعة أو انهيار التطبيق أو نوم الهاتف، التشغيل التالي لنفس الفترة
+يكمل من حيث توقف: العملاء المنتهون يُعادون من السجل كما هم (الرصيد والملف
+والبصمة)، ورقم التقرير الذي ما زال صالحاً يُعاد استخدامه بدل توليد تقرير جديد
+(أغلى خطوة: حتى 300 ثانية). بعد انتهاء الدفعة كاملة يبدأ التشغيل التالي من جديد.
+
+الحالات بالترتيب: balance -> report -> done، أو failed.
+"""
+import os
+import json
+import time
+import hashlib
+from threading import Lock
+
+JOURNAL_FILENAME = ".statement_journal.jsonl"
+REPORT_ID_TTL = 30 * 60  # المدة التي نفترض أن الخادم يحتفظ فيها بالتقرير المولّد
+
+
+def file_sha256(filename, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''): digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobJournal:
+
+    def __init__(self, output_dir, from_date, to_date, report_ttl=REPORT_ID_TTL):
+        self.path = os.path.join(output_dir, JOURNAL_FILENAME)
+        self.run_key = f"{from_date}|{to_date}"
+        self.report_ttl = report_ttl
+        self.states = {}
+        self.finished = False  # بعد finish() لا يُضاف شيء (التشغيل التالي يبدأ من جديد)
+        self._lock = Lock()
+        self._load()
+
+    def _load(self):
+        records, finished = [], True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: records.append(json.loads(line))
+                    except ValueError: continue  # سطر أخير ناقص بعد انهيار
+        except OSError: return
+        for rec in records:
+            if rec.get('run') != self.run_key: continue
+            if rec.get('state') == 'finished':
+                finished = True; self.states = {}
+            else:
+                finished = False
+                self.states.setdefault(rec['id'], {}).update(rec)
+        if finished: self.reset()
+
+    def reset(self):
+        """بداية دفعة جديدة: السجل السابق انتهى أو لفترة أخرى"""
+        with self._lock:
+            self.states = {}
+            try: os.remove(self.path)
+            except OSError: pass
+
+    def record(self, client_id, state, durable=False, **fields):
+        rec = dict(fields, id=str(client_id), state=state, run=self.run_key, t=time.time())
+        with self._lock:
+            self.states.setdefault(rec['id'], {}).update(rec)
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    if durable:
+                        f.flush(); os.fsync(f.fileno())
+            except OSError: pass
+
+    def record_done(self, client_id, filename, msg=' '):
+        try: size, sha = os.path.getsize(filename), file_sha256(filename)
+        except OSError: size, sha = None, None
+        self.record(client_id, 'done', durable=True, file=filename, size=size, sha256=sha, msg=msg)
+
+    def refresh(self, client_id, filename, size, sha256):
+        """حالة done نفسها بحجم وبصمة الملف بعد ضغطه، حتى لا يرفضه completed_row عند الاستئناف"""
+        st = self.states.get(str(client_id))
+        if self.finished or not st or st.get('state') != 'done' or not st.get('file'): return
+        if os.path.abspath(st['file']) != os.path.abspath(filename): return
+        self.record(client_id, 'done', durable=True, file=st['file'], size=size, sha256=sha256)
+
+    def finish(self):
+        self.record('*', 'finished', durable=True)
+        self.finished = True
+
+    def completed_row(self, client_id):
+        """صف الملخص لعميل انتهى في تشغيل سابق وما زال ملفه موجوداً بنفس الحجم، وإلا None"""
+        st = self.states.get(str(client_id))
+        if not st or st.get('state') != 'done' or 'balance' not in st: return None
+        if st.get('file'):
+            try:
+                if os.path.getsize(st['file']) != st.get('size'): return None
+            except OSError: return None
+        return {'id': st['id'], 'name': st.get('name', ''), 'balance': st['balance'], 'balance_float': st.get('balance_float', 0.0),
+                'ok': True, 'msg': st.get('msg', ' '), 'file': st.get('file'), 'sha256': st.get('sha256')}
+
+    def report_id(self, client_id, tx_hash):
+        """رقم تقرير مولّد سابقاً من نفس الحركات (tx_hash) لم تنتهِ صلاحيته بعد"""
+        st = self.states.get(str(client_id))
+        if not st or not st.get('report_id') or not tx_hash or st.get('tx_hash') != tx_hash: return None
+        if time.time() - st.get('report_t', 0) > self.report_ttl: return None
+        return st['report_id']
@@ -0,0 +1,171 @@
+"""
+قياس زمن كل طلب للخادم أثناء الدفعة ومعرفة أين يذهب الوقت.
+
+attach(session) يضيف response hook يسجل لكل طلب: المرحلة (اسم نقطة النهاية في backend.ENDPOINTS)،
+الزمن حتى وصول الترويسات، الحجم، رمز الحالة، وعدد إعادات urllib3 Retry.
+التنزيلات المتدفقة (ملف PDF) تُسجل أيضاً بزمن النقل الكامل عبر observe_transfer.
+كل عينة تُكتب كسطر JSON في logger "booking.metrics"، وفي النهاية:
+report() نص بـ p50/p95 لكل مرحلة وأبطأ العملاء، و export() إلى JSON أو Prometheus.
+"""
+import json
+import time
+import logging
+from threading import Lock, local
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("booking.metrics")
+
+SLOWEST_CLIENTS = 10
+PERCENTILES = (50, 95)
+
+# (الطريقة، المسار) -> اسم المرحلة؛ يُملأ من backend.ENDPOINTS حتى لا تتكرر ثوابت المسارات هنا.
+# المسارات ذات المعاملات ('/Finance/AccountStatement/{agency_id}') تُطابق بالبادئة.
+STAGES = {}
+STAGE_PREFIXES = []
+
+
+def register_stages(mapping):
+    """mapping: اسم المرحلة -> (الطريقة، المسار)"""
+    for stage, (method, path) in mapping.items():
+        path = path.split('?', 1)[0]
+        if '{' in path: STAGE_PREFIXES.append((method.upper(), path.split('{', 1)[0].lower(), stage))
+        else: STAGES[(method.upper(), path.rstrip('/').lower())] = stage
+
+
+def stage_for_url(url, method='GET'):
+    path = urlsplit(url).path.rstrip('/').lower()
+    method = (method or 'GET').upper()
+    stage = STAGES.get((method, path))
+    if stage: return stage
+    for m, prefix, name in STAGE_PREFIXES:
+        if m == method and path.startswith(prefix): return name
+    return 'other'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _retries(response):
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(getattr(retries, 'history', ()) or ())
+
+
+def _body_size(response):
+    # الاستجابات المتدفقة لم تُقرأ بعد عند تنفيذ الـ hook: نكتفي بـ Content-Length
+    if getattr(response, '_content_consumed', False) and response._content:
+        return len(response._content)
+    try: return int(response.headers.get('content-length') or 0)
+    except ValueError: return 0
+
+
+def observe_transfer(session, stage, seconds, nbytes, ok=True):
+    metrics = getattr(session, 'metrics', None)
+    if metrics is not None: metrics.record(stage, seconds, nbytes, ok=ok)
+
+
+class RunMetrics:
+
+    def __init__(self):
+        self.samples = []  # (stage, seconds, bytes, status, retries, ok, client)
+        self.started = time.time()
+        self._lock = Lock()
+        self._local = local()
+
+    def set_client(self, client_id):
+        """العميل الذي يعمل عليه هذا الخيط حالياً (تُنسب إليه الطلبات التالية)"""
+        self._local.client = client_id
+
+    @property
+    def client(self):
+        return getattr(self._local, 'client', None)
+
+    def record(self, stage, seconds, nbytes=0, status=None, retries=0, ok=True):
+        sample = (stage, seconds, nbytes, status, retries, ok, self.client)
+        with self._lock: self.samples.append(sample)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({'stage': stage, 'seconds': round(seconds, 4), 'bytes': nbytes, 'status': status,
+                                     'retries': retries, 'ok': ok, 'client': sample[6]}, ensure_ascii=False))
+
+    def response_hook(self, response, *args, **kwargs):
+        # الطريقة مع المسار: صفحة الدخول (GET، ومنها التحويلات عند انتهاء الجلسة) غير POST الدخول
+        self.record(stage_for_url(response.url, response.request.method), response.elapsed.total_seconds(), _body_size(response),
+                    response.status_code, _retries(response), response.status_code < 400)
+
+    def attach(self, session):
+        if self.response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self.response_hook)
+        session.metrics = self
+        return session
+
+    def stage_stats(self):
+        with self._lock: samples = list(self.samples)
+        stages = {}
+        for stage, seconds, nbytes, status, retries, ok, _ in samples:
+            st = stages.setdefault(stage, {'count': 0, 'errors': 0, 'bytes': 0, 'retries': 0, 'statuses': {}, 'times': []})
+            st['count'] += 1
+            st['errors'] += 0 if ok else 1
+            st['bytes'] += nbytes or 0
+            st['retries'] += retries
+            if status is not None: st['statuses'][status] = st['statuses'].get(status, 0) + 1
+            st['times'].append(seconds)
+        for st in stages.values():
+            times = sorted(st.pop('times'))
+            st['total'] = sum(times)
+            st['max'] = times[-1]
+            for pct in PERCENTILES: st[f'p{pct}'] = percentile(times, pct)
+        return stages
+
+    def slowest_clients(self, limit=SLOWEST_CLIENTS):
+        """مجموع زمن الطلبات لكل عميل مع المرحلة الأبطأ لديه"""
+        with self._lock: samples = list(self.samples)
+        clients = {}
+        for stage, seconds, _, _, _, ok, client in samples:
+            if client is None: continue
+            c = clients.setdefault(client, {'id': client, 'seconds': 0.0, 'stages': {}, 'failed': []})
+            c['seconds'] += seconds
+            c['stages'][stage] = c['stages'].get(stage, 0.0) + seconds
+            if not ok: c['failed'].append(stage)
+        ranked = sorted(clients.values(), key=lambda c: c['seconds'], reverse=True)[:limit]
+        for c in ranked: c['slowest_stage'] = max(c['stages'], key=c['stages'].get)
+        return ranked
+
+    def to_dict(self):
+        return {'started': self.started, 'elapsed': time.time() - self.started,
+                'stages': self.stage_stats(), 'slowest_clients': self.slowest_clients()}
+
+    def report(self):
+        lines = [f"{'stage':<20}{'count':>7}{'err':>5}{'retry':>7}{'p50 s':>9}{'p95 s':>9}{'max s':>9}{'MB':>9}"]
+        for stage, st in sorted(self.stage_stats().items(), key=lambda kv: -kv[1]['total']):
+            lines.append(f"{stage:<20}{st['count']:>7}{st['errors']:>5}{st['retries']:>7}"
+                         f"{st['p50']:>9.2f}{st['p95']:>9.2f}{st['max']:>9.2f}{st['bytes'] / 1e6:>9.2f}")
+        slowest = self.slowest_clients()
+        if slowest:
+            lines.append("slowest clients:")
+            for c in slowest:
+                failed = f" failed: {','.join(c['failed'])}" if c['failed'] else ""
+                lines.append(f"  {c['id']:<12}{c['seconds']:>9.2f} s  (mostly {c['slowest_stage']}){failed}")
+        return '\n'.join(lines)
+
+    def prometheus(self):
+        stats = sorted(self.stage_stats().items())
+        out = []
+        for name, key in (('booking_requests_total', 'count'), ('booking_request_errors_total', 'errors'),
+                          ('booking_request_retries_total', 'retries'), ('booking_request_bytes_total', 'bytes')):
+            out.append(f"# TYPE {name} counter")
+            out += [f'{name}{{stage="{stage}"}} {st[key]}' for stage, st in stats]
+        out.append("# TYPE booking_request_seconds summary")
+        for stage, st in stats:
+            out += [f'booking_request_seconds{{stage="{stage}",quantile="{pct / 100:g}"}} {st[f"p{pct}"]:.4f}' for pct in PERCENTILES]
+            out += [f'booking_request_seconds_sum{{stage="{stage}"}} {st["total"]:.4f}',
+                    f'booking_request_seconds_count{{stage="{stage}"}} {st["count"]}']
+        return '\n'.join(out) + '\n'
+
+    def export(self, filename):
+        """JSON، أو نص Prometheus إذا انتهى الاسم بـ .prom أو .txt"""
+        text = self.prometheus() if filename.endswith(('.prom', '.txt')) else json.dumps(self.to_dict(), ensure_ascii=False, indent=1)
+        with open(filename, 'w', encoding='utf-8') as f: f.write(text)
@@ -0,0 +1,214 @@
+"""
+مرحلة ما بعد التنزيل (اختيارية): تبدأ مع كل PDF فور انتهائه بدلاً من العمل اليدوي بعد الدفعة.
+
+- ضغط بدون فقد: pikepdf (qpdf) يعيد ضغط التدفقات ويجمع الكائنات في object streams،
+  وإلا pypdf يضغط تدفقات المحتوى. يُستبدل الملف فقط إذا صار أصغر.
+- الضغط وحساب SHA-256 في مجمع عمليات (المعالج وليس الشبكة هو الحد هنا)، ومجمع
+  خيوط بدلاً منه حيث لا تتوفر العمليات المتعددة (أندرويد).
+- ZIP للتشغيل يُكتب ملفاً ملفاً على القرص بمجرد جاهزية كل ملف (لا يُبنى في الذاكرة).
+- manifest JSON بالحجم قبل وبعد والبصمة لكل ملف، يُضاف أيضاً داخل ZIP.
+- ملف "كل الكشوفات" مدمج بترتيب صفوف Summary.xlsx وفهرس (bookmark) لكل صف.
+  يحتاج pikepdf: تُنسخ التدفقات من الملفات الأصلية أثناء الحفظ فلا تُحمّل كلها في
+  الذاكرة (pypdf يحتفظ بكل الصفحات حتى الكتابة، لذلك لا يُستخدم للدمج).
+
+pikepdf و pypdf تُستوردان عند الضغط أو الدمج فقط، فاستيراد الوحدة خفيف.
+"""
+import os
+import json
+import time
+import zipfile
+import importlib
+from queue import Queue
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+
+from journal import file_sha256
+
+POSTPROCESS_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MERGED_FILENAME = "All_Statements.pdf"
+
+
+def _optional(name):
+    try: return importlib.import_module(name)
+    except ImportError: return None
+
+
+def _compact_pikepdf(pikepdf, path, tmp):
+    with pikepdf.open(path) as pdf:
+        pdf.remove_unreferenced_resources()
+        pdf.save(tmp, compress_streams=True, recompress_flate=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+
+def _compact_pypdf(pypdf, path, tmp):
+    writer = pypdf.PdfWriter(clone_from=path)
+    for page in writer.pages: page.compress_content_streams()
+    if hasattr(writer, 'compress_identical_objects'): writer.compress_identical_objects()
+    with open(tmp, 'wb') as f: writer.write(f)
+
+
+def compact_pdf(path):
+    """ضغط بدون فقد في نفس المكان إذا صار الملف أصغر؛ يعيد اسم الطريقة المستخدمة أو None"""
+    method, compact = 'pikepdf', _compact_pikepdf
+    lib = _optional(method)
+    if lib is None: method, compact, lib = 'pypdf', _compact_pypdf, _optional('pypdf')
+    if lib is None: return None
+    tmp = path + '.compact'
+    try:
+        compact(lib, path, tmp)
+        if os.path.getsize(tmp) < os.path.getsize(path):
+            os.replace(tmp, path)
+            return method
+        return None
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+
+
+def process_file(path, compact=True):
+    """يعمل في عملية منفصلة: الضغط ثم البصمة"""
+    entry = {'file': path, 'original_size': os.path.getsize(path), 'compacted': None}
+    if compact:
+        try: entry['compacted'] = compact_pdf(path)
+        except Exception as e: entry['error'] = str(e)  # ملف تالف أو غير مدعوم: يبقى كما هو
+    entry['size'] = os.path.getsize(path)
+    entry['sha256'] = file_sha256(path)
+    return entry
+
+
+def row_files(row):
+    """ملفات PDF الخاصة بصف العميل: الكشف، أو الأجزاء المذكورة في فهرس sharding"""
+    path = row.get('file')
+    if not row.get('ok') or not path or not os.path.exists(path): return []
+    if path.endswith('.json'):
+        try:
+            with open(path, 'r', encoding='utf-8') as f: parts = json.load(f).get('parts', [])
+        except (OSError, ValueError): return []
+        return [os.path.join(os.path.dirname(path), p['file']) for p in parts]
+    return [path] if path.lower().endswith('.pdf') else []
+
+
+def bookmark_title(row):
+    """نفس بيانات صف الملخص: الاسم والرقم والرصيد"""
+    return f"{row['name']} ({row['id']}) - {row.get('balance', '')}"
+
+
+def _pool(workers):
+    # spawn وليس fork: العملية الأم فيها خيوط شبكة وأقفال
+    try:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    except (ImportError, NotImplementedError, OSError): return ThreadPoolExecutor(max_workers=workers)
+
+
+class PostProcessor:
+    """
+    add(idx, row) من run_batch بعد انتهاء كل عميل (نفس واجهة SummaryWriter)،
+    و close() بعد الدفعة ينتظر المتبقي ويكتب ZIP و manifest والملف المدمج.
+    """
+
+    def __init__(self, output_dir, compact=True, zip_path=None, merge_path=None, manifest_path=None,
+                 workers=POSTPROCESS_WORKERS):
+        self.output_dir, self.compact = output_dir, compact
+        self.zip_path, self.merge_path = zip_path, merge_path
+        self.manifest_path = manifest_path or os.path.join(output_dir, f"Statements_{time.strftime('%Y%m%d_%H%M%S')}_manifest.json")
+        self.rows, self.entries = {}, []
+        self._lock = Lock()
+        self._pool = _pool(workers)
+        self._zip = None
+        if zip_path:
+            os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+            self._zip = zipfile.ZipFile(zip_path + '.part', 'w', zipfile.ZIP_STORED, allowZip64=True)
+        # كاتب واحد لـ ZIP و manifest بترتيب اكتمال الملفات
+        self._done = Queue()
+        self._writer = Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def add(self, idx, row, statements=None, journal=None):
+        """
+        statements (StatementManifest) و journal (JobJournal) الخاصان بالدفعة: يُحدث فيهما
+        حجم الملف المضغوط حتى يبقى التخطي والاستئناف صالحين.
+        """
+        files = row_files(row)
+        if not files: return
+        with self._lock: self.rows[idx] = (row, files)
+        # ملف "Unchanged" ضُغط في تشغيل سابق؛ نكتفي بالبصمة
+        compact = self.compact and row.get('msg') != "Unchanged"
+        for path in files:
+            future = self._pool.submit(process_file, path, compact)
+            future.add_done_callback(lambda f, idx=idx, path=path: self._done.put((idx, path, f, statements, journal)))
+
+    def _write_loop(self):
+        while True:
+            item = self._done.get()
+            if item is None: return
+            idx, path, future, statements, journal = item
+            try: entry = future.result()
+            except Exception as e:
+                entry = {'file': path, 'error': str(e), 'compacted': None}
+                entry['size'] = entry['original_size'] = os.path.getsize(path)
+                entry['sha256'] = file_sha256(path)
+            row = self.rows[idx][0]
+            if entry['compacted']:
+                if statements: statements.refresh(path)
+                if journal: journal.refresh(row['id'], path, entry['size'], entry['sha256'])
+            entry.update(index=idx, id=row['id'], name=row['name'], file=os.path.relpath(path, self.output_dir))
+            if self._zip:
+                try: self._zip.write(path, entry['file'])  # يُنسخ من القرص على دفعات
+                except OSError as e: entry['error'] = f"zip: {e}"
+            with self._lock: self.entries.append(entry)
+
+    def merge(self, merge_path):
+        """كل الكشوفات في ملف واحد بترتيب الملخص، بفهرس لكل عميل"""
+        pikepdf = _optional('pikepdf')
+        if pikepdf is None: raise RuntimeError("merging needs pikepdf (pypdf would hold every page in memory)")
+        ordered = [(row, files) for _, (row, files) in sorted(self.rows.items())]
+        tmp = merge_path + '.part'
+        merged, sources = pikepdf.new(), []
+        try:
+            with merged.open_outline() as outline:
+                for row, files in ordered:
+                    start = len(merged.pages)
+                    for path in files:
+                        # المصدر يبقى مفتوحاً حتى الحفظ: qpdf يقرأ التدفقات منه عند الكتابة
+                        src = pikepdf.open(path)
+                        sources.append(src)
+                        merged.pages.extend(src.pages)
+                    if len(merged.pages) > start: outline.root.append(pikepdf.OutlineItem(bookmark_title(row), start))
+            merged.save(tmp)
+        finally:
+            merged.close()
+            for src in sources: src.close()
+        os.replace(tmp, merge_path)
+        return True
+
+    def close(self):
+        """ينتظر كل الملفات ثم يكتب manifest ويغلق ZIP ويدمج؛ يعيد ملخص النتائج"""
+        self._pool.shutdown(wait=True)
+        self._done.put(None)
+        self._writer.join()
+        self.entries.sort(key=lambda e: (e['index'], e['file']))
+        original, final = sum(e['original_size'] for e in self.entries), sum(e['size'] for e in self.entries)
+        manifest = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'files': len(self.entries),
+                    'original_size': original, 'size': final, 'entries': self.entries}
+        result = {'files': len(self.entries), 'original_size': original, 'size': final,
+                  'errors': sum(1 for e in self.entries if e.get('error')), 'manifest': self.manifest_path}
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+        if self._zip:
+            self._zip.write(self.manifest_path, os.path.basename(self.manifest_path), zipfile.ZIP_DEFLATED)
+            self._zip.close()
+            os.replace(self.zip_path + '.part', self.zip_path)
+            result['zip'] = self.zip_path
+        if self.merge_path and self.rows:
+            try:
+                if self.merge(self.merge_path): result['merged'] = self.merge_path
+            except Exception as e: result['merge_error'] = str(e)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,111 @@
+"""
+محدد معدل تكيفي (token bucket + AIMD) بدلاً من time.sleep ثابت بين العملاء.
+
+- يزيد المعدل تدريجياً (زيادة جمعية) ما دام الخادم يجيب بسرعة وبدون أخطاء.
+- يخفضه للنصف (نقصان ضربي) عند 429/5xx أو عندما يتضاعف زمن الاستجابة مقارنة
+  بالمعتاد لنفس نقطة النهاية، ويحترم Retry-After بإيقاف الإصدار مؤقتاً.
+
+response_hook يُضاف إلى session.hooks['response'] فيرى كل طلب تلقائياً، ومعه
+الردود التي أعاد urllib3 محاولتها داخلياً (response.raw.retries.history) مع
+Retry-After الخاص بكل منها إذا كانت سياسة الإعادة ObservedRetry.
+"""
+import time
+import email.utils
+from threading import Lock
+from urllib.parse import urlsplit
+
+from urllib3.util.retry import Retry
+
+DEFAULT_RATE = 2.0          # يطابق sleep(0.5) السابق
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+ADDITIVE_INCREASE = 0.1
+MULTIPLICATIVE_DECREASE = 0.5
+SLOWDOWN_FACTOR = 2.0       # زمن أعلى من ضعف المعتاد = ازدحام
+BASELINE_ALPHA = 0.1
+MIN_SLOW_LATENCY = 1.0      # لا نعتبر ما دون ثانية ازدحاماً مهما كان المعتاد
+CONGESTION_STATUSES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """Retry-After بالثواني أو كتاريخ HTTP"""
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try: return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError): return None
+
+
+class ObservedRetry(Retry):
+    """Retry يحتفظ بقيمة Retry-After لكل محاولة بجانب history (الذي لا يحفظ الترويسات)"""
+
+    retry_afters = ()
+
+    def increment(self, method=None, url=None, response=None, *args, **kwargs):
+        new_retry = super().increment(method, url, response, *args, **kwargs)
+        new_retry.retry_afters = self.retry_afters + (response.headers.get('Retry-After') if response is not None else None,)
+        return new_retry
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, burst=1.0):
+        self.rate, self.min_rate, self.max_rate, self.burst = rate, min_rate, max_rate, burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._baseline = {}
+        self._lock = Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, stop_event=None):
+        """ينتظر حتى يتوفر رمز؛ يعيد False إذا طُلب الإيقاف أثناء الانتظار"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    wait = (1 - self._tokens) / self.rate
+            if stop_event is not None:
+                if stop_event.wait(min(wait, 0.25)): return False
+            else:
+                time.sleep(min(wait, 0.25))
+
+    def observe(self, endpoint, latency, status=200, retry_after=None):
+        with self._lock:
+            baseline = self._baseline.get(endpoint)
+            slow = baseline is not None and latency > max(MIN_SLOW_LATENCY, baseline * SLOWDOWN_FACTOR)
+            if status in CONGESTION_STATUSES or slow:
+                self.rate = max(self.min_rate, self.rate * MULTIPLICATIVE_DECREASE)
+            elif status < 400:
+                self.rate = min(self.max_rate, self.rate + ADDITIVE_INCREASE)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            # الأزمنة البطيئة لا تُحتسب بكامل وزنها حتى لا يتكيف "المعتاد" مع الازدحام
+            if status < 400:
+                sample = min(latency, baseline * SLOWDOWN_FACTOR) if baseline else latency
+                self._baseline[endpoint] = sample if baseline is None else baseline + BASELINE_ALPHA * (sample - baseline)
+
+    def response_hook(self, response, *args, **kwargs):
+        endpoint = urlsplit(response.url).path
+        # 429/503 التي أعاد urllib3 محاولتها لا تصل إلى هنا كردود مستقلة
+        retries = getattr(getattr(response, 'raw', None), 'retries', None)
+        waits = getattr(retries, 'retry_afters', ())
+        for i, attempt in enumerate(getattr(retries, 'history', None) or ()):
+            if attempt.status not in CONGESTION_STATUSES: continue
+            wait = parse_retry_after(waits[i]) if i < len(waits) and attempt.status in (429, 503) else None
+            self.observe(endpoint, 0.0, attempt.status, wait)
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response.status_code in (429, 503) else None
+        self.observe(endpoint, response.elapsed.total_seconds(), response.status_code, retry_after)
+
+    def attach(self, session):
+        if self.response_hook not in session.hooks['response']:
+            session.hooks['response'].append(self.response_hook)
+        return session
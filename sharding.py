@@ -0,0 +1,256 @@
+"""
+تقسيم كشف الحساب الطويل إلى فترات (شهر أو ربع سنة) لكبار الوكلاء.
+
+تقرير متعدد السنوات يقترب من مهلة 300 ثانية في ReportAccountStatement وملفه
+الواحد يتجاوز أحياناً مهلة 600 ثانية في التنزيل. بدلاً من ذلك: تقرير قصير لكل
+فترة، تُولّد وتُنزّل بالتوازي، ثم تُدمج في ملف واحد بفهرس (bookmark) لكل فترة
+إذا توفرت pypdf، وإلا تبقى الأجزاء مع ملف فهرس JSON بجانبها.
+
+التحقق من الأرصدة: الموقع يعيد TotalBalance حتى اليوم فقط، لذلك يُحسب من صفوف الحركات:
+- كل حركة في الفترة الكاملة ظهرت في فترة واحدة فقط (لا فجوات ولا تكرار).
+- مجموع مبالغ الفترات يساوي مجموع مبالغ الفترة الكاملة (الختامي - الافتتاحي).
+- إذا حملت الصفوف رصيداً جارياً: الافتتاحي لكل فترة (رصيد أول صف - مبلغه) يساوي
+  الختامي للفترة السابقة (رصيد آخر صف فيها).
+الفحصان الأخيران يُتخطيان إذا لم تحمل الصفوف مبالغ أو أرصدة بصيغة معروفة.
+
+داخل run_batch لا يعمل في نفس الوقت أكثر من slots جزءاً لكل الدفعة، حتى لا تتجاوز
+طلبات التقارير (حتى 300 ثانية لكل منها) مجمع اتصالات الجلسة. AdaptiveRateLimiter
+يحدد بدء العملاء فقط، ويرى ردود الأجزاء عبر hook الجلسة.
+"""
+import os
+import json
+from datetime import date, datetime, timedelta
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from pypdf import PdfWriter
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+from backend import (
+    DATE_FORMAT, STATEMENT_ROWS_KEY, get_account_statement, extract_transactions_from_statement, get_report_id,
+    get_control_id_and_download_pdf, resolve_client_balance, statement_filename, download_single_pdf,
+)
+
+SHARD_PERIODS = {'month': 1, 'quarter': 3, 'year': 12}
+SHARD_WORKERS = 4
+AMOUNT_KEYS = ('Amount', 'NetAmount', 'Value')
+RUNNING_BALANCE_KEYS = ('RunningBalance', 'Balance', 'CumulativeBalance')
+BALANCE_TOLERANCE = 0.005
+
+
+def parse_date(text):
+    return datetime.strptime(text, DATE_FORMAT).date() if text else date.today()
+
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    return date(value.year + month // 12, month % 12 + 1, 1)
+
+
+def date_windows(from_date, to_date='', period='quarter'):
+    """فترات متتالية بحدود الأشهر/الأرباع: [(من، إلى)] بصيغة DATE_FORMAT"""
+    months = SHARD_PERIODS[period]
+    start, end = parse_date(from_date), parse_date(to_date)
+    windows = []
+    while start <= end:
+        # بداية الفترة التالية على حدود الربع/السنة وليس بعد months من تاريخ البداية
+        aligned = date(start.year, (start.month - 1) // months * months + 1, 1)
+        nxt = _add_months(aligned, months)
+        windows.append((format_date(start), format_date(min(end, nxt - timedelta(days=1)))))
+        start = nxt
+    return windows
+
+
+def part_filename(final_filename, index):
+    return f"{os.path.splitext(final_filename)[0]}_part{index:02d}.pdf"
+
+
+def index_filename(final_filename):
+    return f"{os.path.splitext(final_filename)[0]}_parts.json"
+
+
+def split_ids(transactions_list):
+    return [t for t in (transactions_list or '').split(',') if t]
+
+
+def check_partition(full_transactions, shards):
+    """المشاكل في توزيع الحركات على الفترات (قائمة فارغة = متطابق)"""
+    seen, problems = {}, []
+    for shard in shards:
+        for tx in split_ids(shard['transactions']):
+            if tx in seen: problems.append(f"transaction {tx} in {seen[tx]} and {shard['from']}")
+            seen[tx] = shard['from']
+    missing = [tx for tx in split_ids(full_transactions) if tx not in seen]
+    if missing: problems.append(f"{len(missing)} transactions missing from the shards (first: {missing[0]})")
+    return problems
+
+
+def statement_rows(data):
+    rows = data.get(STATEMENT_ROWS_KEY) if isinstance(data, dict) else None
+    return [r for r in rows if isinstance(r, dict)] if isinstance(rows, list) else []
+
+
+def _number(value):
+    try: return float(str(value).replace(',', ''))
+    except (TypeError, ValueError): return None
+
+
+def row_amount(row):
+    if 'Debit' in row or 'Credit' in row:
+        debit, credit = _number(row.get('Debit') or 0), _number(row.get('Credit') or 0)
+        return None if debit is None or credit is None else debit - credit
+    return next((_number(row[k]) for k in AMOUNT_KEYS if row.get(k) not in (None, '')), None)
+
+
+def row_balance(row):
+    return next((_number(row[k]) for k in RUNNING_BALANCE_KEYS if row.get(k) not in (None, '')), None)
+
+
+def movement(rows):
+    """صافي حركة الفترة، أو None إذا لم تُعرف مبالغ كل الصفوف"""
+    amounts = [row_amount(r) for r in rows]
+    return None if None in amounts else round(sum(amounts), 2)
+
+
+def opening_closing(rows):
+    """(الافتتاحي، الختامي) من الرصيد الجاري لأول وآخر صف، أو (None, None)"""
+    if not rows: return None, None
+    first, last, amount = row_balance(rows[0]), row_balance(rows[-1]), row_amount(rows[0])
+    if first is None or last is None or amount is None: return None, None
+    return round(first - amount, 2), round(last, 2)
+
+
+def check_balances(full_rows, shards):
+    """المشاكل في أرصدة الفترات مقارنة بالفترة الكاملة (قائمة فارغة = متطابق أو لا يمكن الفحص)"""
+    problems = []
+    total, moves = movement(full_rows), [s['movement'] for s in shards]
+    if total is not None and None not in moves and abs(sum(moves) - total) > BALANCE_TOLERANCE:
+        problems.append(f"shard movements {sum(moves):,.2f} != full range {total:,.2f}")
+    previous = None
+    for shard in shards:
+        if shard.get('opening') is None: continue
+        if previous and abs(shard['opening'] - previous['closing']) > BALANCE_TOLERANCE:
+            problems.append(f"opening {shard['opening']:,.2f} on {shard['from']} != closing {previous['closing']:,.2f} on {previous['to']}")
+        previous = shard
+    return problems
+
+
+def merge_parts(shards, final_filename):
+    """دمج الأجزاء بالترتيب في ملف واحد بفهرس لكل فترة؛ الكتابة لملف مؤقت ثم نقل ذري"""
+    writer = PdfWriter()
+    for shard in shards: writer.append(shard['file'], outline_item=f"{shard['from']} - {shard['to']}")
+    tmp = final_filename + '.part'
+    with open(tmp, 'wb') as f: writer.write(f)
+    writer.close()
+    os.replace(tmp, final_filename)
+
+
+def write_index(shards, final_filename, client_id, client_name):
+    path = index_filename(final_filename)
+    index = {'id': client_id, 'name': client_name, 'parts': [
+        {'from': s['from'], 'to': s['to'], 'file': os.path.basename(s['file']), 'size': os.path.getsize(s['file']),
+         'movement': s['movement'], 'opening': s['opening'], 'closing': s['closing']} for s in shards]}
+    with open(path, 'w', encoding='utf-8') as f: json.dump(index, f, ensure_ascii=False, indent=1)
+    return path
+
+
+class _ShardProgress:
+    """مجموع تقدم كل الأجزاء المتوازية كتقدم ملف واحد"""
+
+    def __init__(self, callback):
+        self.callback, self.parts, self._lock = callback, {}, Lock()
+
+    def for_part(self, index):
+        if not self.callback: return None
+        def report(cur, tot):
+            with self._lock:
+                self.parts[index] = (cur, tot)
+                done, total = sum(c for c, _ in self.parts.values()), sum(t for _, t in self.parts.values())
+            self.callback(done, total)
+        return report
+
+
+def download_sharded_statement(session, client_id, client_name, output_dir, from_date, to_date, report_token,
+                               period='quarter', workers=SHARD_WORKERS, progress_callback=None, stop_event=None, merge=True,
+                               slots=None):
+    """
+    كشف واحد بعدة تقارير قصيرة متوازية. يعيد (ok, msg, path) حيث path هو الملف
+    المدمج أو ملف فهرس الأجزاء. فترة واحدة فقط = المسار العادي download_single_pdf.
+    """
+    windows = date_windows(from_date, to_date, period)
+    final_filename = statement_filename(output_dir, client_name, client_id)
+
+    def single():
+        ok, msg = download_single_pdf(session, client_id, client_name, output_dir, from_date, to_date, report_token,
+                                      progress_callback, stop_event)
+        return ok, msg, final_filename if ok else None
+    if len(windows) < 2: return single()
+    full_data = get_account_statement(session, client_id, from_date, to_date)
+    full = extract_transactions_from_statement(full_data)
+    # الأجزاء تحتاج حركات كل فترة من JSON؛ إذا لم نتعرف على شكله فتقرير واحد بحركات الصفحة
+    if full is None: return single() if full_data is not None else (False, "Statement failed", None)
+    os.makedirs(output_dir, exist_ok=True)
+    progress = _ShardProgress(progress_callback)
+
+    def run_shard(item):
+        index, (w_from, w_to) = item
+        shard = {'index': index, 'from': w_from, 'to': w_to, 'file': part_filename(final_filename, index), 'ok': False,
+                 'movement': None, 'opening': None, 'closing': None}
+        if not slots: return fill_shard(shard)
+        with slots: return fill_shard(shard)
+
+    def fill_shard(shard):
+        w_from, w_to, index = shard['from'], shard['to'], shard['index']
+        if stop_event and stop_event.is_set(): return dict(shard, msg="Cancelled")
+        # كل الأجزاء على نفس الجلسة (الترويسات لكل طلب، ولا يُعدل session.headers)
+        data = get_account_statement(session, client_id, w_from, w_to)
+        shard['transactions'] = extract_transactions_from_statement(data)
+        if shard['transactions'] is None: return dict(shard, msg="Statement failed")
+        rows = statement_rows(data)
+        shard['movement'] = movement(rows)
+        shard['opening'], shard['closing'] = opening_closing(rows)
+        if not shard['transactions']: return dict(shard, ok=True, msg="Empty", file=None)
+        rid = get_report_id(session, client_id, report_token, shard['transactions'], w_from, w_to)
+        if not rid: return dict(shard, msg="Report failed")
+        ok = get_control_id_and_download_pdf(session, rid, client_name, client_id, shard['file'], progress.for_part(index), stop_event)
+        if not ok and stop_event and stop_event.is_set(): return dict(shard, msg="Cancelled")
+        return dict(shard, ok=ok, msg="" if ok else "Download failed")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as pool:
+        shards = list(pool.map(run_shard, enumerate(windows, 1)))
+    failed = [s for s in shards if not s['ok']]
+    # جزء أُلغي = الكشف كله أُلغي (وليس فشلاً)، بنفس رسالة المسار العادي
+    if any(s['msg'] == "Cancelled" for s in failed) or (failed and stop_event and stop_event.is_set()): return False, "Cancelled", None
+    if failed: return False, f"{failed[0]['msg']} ({failed[0]['from']} - {failed[0]['to']})", None
+    problems = check_partition(full, shards) + check_balances(statement_rows(full_data), shards)
+    if problems: return False, "Shard check failed: " + "; ".join(problems[:3]), None
+    parts = [s for s in shards if s['file']]
+    if not parts: return True, "No transactions", None
+    if merge and PYPDF_AVAILABLE:
+        try:
+            merge_parts(parts, final_filename)
+            for s in parts: os.remove(s['file'])
+            return True, f"({len(parts)} parts merged)", final_filename
+        except Exception: pass  # الأجزاء سليمة؛ نكتفي بالفهرس
+    return True, f"({len(parts)} parts)", write_index(parts, final_filename, client_id, client_name)
+
+
+def process_sharded_client(session, cid, name, out_dir, from_date, to_date, report_token, on_progress=None, stop_event=None,
+                           period='quarter', workers=SHARD_WORKERS, slots=None):
+    """مثل backend.process_client لكن الكشف مقسم إلى فترات"""
+    bal_raw, bal_float = resolve_client_balance(session, cid, from_date)
+    row = {'id': cid, 'name': name, 'balance': bal_raw, 'balance_float': bal_float}
+    prog = (lambda cur, tot: on_progress(row, cur, tot)) if on_progress else None
+    try: ok, msg, path = download_sharded_statement(session, cid, name, out_dir, from_date, to_date, report_token,
+                                                    period, workers, prog, stop_event, slots=slots)
+    except Exception as e: ok, msg, path = False, str(e), None
+    row['ok'], row['msg'] = ok, msg
+    if path: row['file'] = path
+    return row
@@ -0,0 +1,100 @@
+"""
+ملخص الدفعة يُكتب أثناء التشغيل بدلاً من بنائه كاملاً في الذاكرة وحفظه في النهاية.
+
+- Summary.csv: سطر لكل عميل فور انتهائه مع flush، فيبقى ملخص جزئي صالح بعد أي انهيار.
+- Summary.xlsx: openpyxl في وضع write_only (الصفوف تُكتب لملف مؤقت فالذاكرة ثابتة
+  مهما كثر العملاء) ويُحفظ عند close() مع سطر الإجمالي.
+
+الرصيد يُكتب كرقم (يمكن جمعه في Excel) والنص المنسق في عمود مستقل.
+الصفوف تُكتب بترتيب المدخلات: ما ينتهي مبكراً من العمال المتوازين ينتظر دوره.
+"""
+import os
+import csv
+from threading import Lock
+
+SUMMARY_COLUMNS = ["ID", "Name", "Balance", "Balance Text", "Status", "Message", "Seconds", "File", "Size"]
+BALANCE_FORMAT = '#,##0.00'
+
+
+def row_status(row):
+    if row.get('ok'): return 'unchanged' if row.get('msg') == "Unchanged" else 'ok'
+    return 'cancelled' if row.get('msg') == "Cancelled" else 'failed'
+
+
+def summary_values(row):
+    path = row.get('file')
+    try: size = os.path.getsize(path) if path else None
+    except OSError: size = None
+    seconds = row.get('seconds')
+    return [row['id'], row['name'], row.get('balance_float', 0.0), row.get('balance', ''), row_status(row),
+            (row.get('msg') or '').strip(), round(seconds, 2) if seconds is not None else None, path, size]
+
+
+class SummaryWriter:
+
+    def __init__(self, xlsx_path, csv_path=None):
+        self.xlsx_path = xlsx_path
+        self.csv_path = csv_path or os.path.splitext(xlsx_path)[0] + '.csv'
+        os.makedirs(os.path.dirname(os.path.abspath(xlsx_path)), exist_ok=True)
+        # utf-8-sig حتى يعرض Excel الأسماء العربية في CSV بشكل صحيح
+        self._csv_file = open(self.csv_path, 'w', encoding='utf-8-sig', newline='')
+        self._csv = csv.writer(self._csv_file)
+        self._csv.writerow(SUMMARY_COLUMNS)
+        self._csv_file.flush()
+        self._wb = self._ws = self._cell = None
+        # openpyxl ثقيلة: تُستورد فقط عند كتابة ملخص فعلاً
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError: Workbook = None
+        if Workbook is not None:
+            self._cell = WriteOnlyCell
+            self._wb = Workbook(write_only=True)
+            self._ws = self._wb.create_sheet("Summary")
+            self._ws.append(SUMMARY_COLUMNS)
+        self._pending = {}
+        self._next = 1
+        self._lock = Lock()
+        self.rows = 0
+        self.total = 0.0
+
+    def add(self, idx, row):
+        """idx يبدأ من 1 كما في run_batch"""
+        with self._lock:
+            self._pending[idx] = row
+            while self._next in self._pending:
+                self._write(self._pending.pop(self._next))
+                self._next += 1
+
+    def _write(self, row):
+        values = summary_values(row)
+        self._csv.writerow(['' if v is None else v for v in values])
+        self._csv_file.flush()
+        if self._ws is not None:
+            balance = self._cell(self._ws, value=values[2])
+            balance.number_format = BALANCE_FORMAT
+            self._ws.append(values[:2] + [balance] + values[3:])
+        self.rows += 1
+        if row.get('ok'): self.total += row.get('balance_float', 0.0)
+
+    def close(self):
+        """كتابة ما تبقى (دفعة متوقفة تترك فجوات في الترتيب) ثم حفظ ملف Excel"""
+        with self._lock:
+            for idx in sorted(self._pending): self._write(self._pending[idx])
+            self._pending = {}
+            if not self._csv_file.closed: self._csv_file.close()
+            if self._wb is None: return False
+            total = self._cell(self._ws, value=round(self.total, 2))
+            total.number_format = BALANCE_FORMAT
+            self._ws.append(["", "Total", total])
+            try:
+                self._wb.save(self.xlsx_path)
+                return True
+            except: return False
+            finally: self._wb = self._ws = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()